@@ -3,18 +3,27 @@
 #----------------------------------------------------------------------------#
 
 import json
+import click
 import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+from itertools import groupby
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, jsonify
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from flask_migrate import Migrate
-from datetime import datetime
+from sqlalchemy import event, exc
+from sqlalchemy.orm import make_transient_to_detached
+from datetime import datetime, timedelta
 from forms import *
 from helpers import *
+from search import search_by_name
+from filters import format_datetime, format_datetimes
+from cache import ResponseCache
+from importer import read_records, run_import, import_separately
+from dbpool import pool_metrics
+from sqlprofiler import SQLProfiler
+from applog import start_file_logging
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -25,6 +34,22 @@ app.config.from_object('config')
 db = SQLAlchemy(app)
 
 migrate = Migrate(app, db)
+response_cache = ResponseCache(app)
+pool_metrics.init_engine(db.engine)
+sql_profiler = SQLProfiler(app)
+
+# maximum number of SQL statements issued while serving a venue or artist
+# page, including lazy loads made by its template. Checked by the tests.
+DETAIL_PAGE_MAX_QUERIES = 3
+
+# number of rows per page of the /artists and /shows listings
+LISTING_PAGE_SIZE = 50
+
+# number of rows fetched from the database at a time while streaming /venues
+VENUE_LISTING_BATCH_SIZE = 500
+
+# number of rows fetched from the database at a time by the /api exports
+EXPORT_BATCH_SIZE = 1000
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -33,12 +58,14 @@ migrate = Migrate(app, db)
 
 artist_genres = db.Table('artist_genres',
     db.Column('artist_id', db.Integer, db.ForeignKey('artists.id'), primary_key=True),
-    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True)
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id')
     )
 
 venue_genres = db.Table('venue_genres',
     db.Column('venue_id', db.Integer, db.ForeignKey('venues.id'), primary_key=True),
-    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True)
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id')
     )
 
 class Venue(db.Model):
@@ -56,6 +83,8 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String())
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     genres = db.relationship('Genre', secondary=venue_genres, backref=db.backref('venues', lazy=True))
 
     shows = db.relationship("Show", back_populates="venue")
@@ -75,6 +104,8 @@ class Artist(db.Model):
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     shows = db.relationship("Show", back_populates="artist")
     genres = db.relationship('Genre', secondary=artist_genres, backref=db.backref('artists', lazy=True))
 
@@ -89,6 +120,13 @@ class Genre(db.Model):
 
 class Show(db.Model):
   __tablename__ = 'shows'
+  # the primary key serves lookups by venue, these serve lookups by artist,
+  # by venue and time, and listings ordered by time
+  __table_args__ = (
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_start_time_venue_id_artist_id', 'start_time', 'venue_id', 'artist_id'),
+  )
   venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), primary_key=True)
   artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), primary_key=True)
   venue = db.relationship("Venue", back_populates="shows")
@@ -104,19 +142,284 @@ class Show(db.Model):
 
 
 #----------------------------------------------------------------------------#
-# Filters.
+# Show Counters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  if type(value) != datetime:
-    date = dateutil.parser.parse(value)
+# Venues and artists store their number of upcoming and past shows so that
+# listings read a column instead of counting shows. The counters are adjusted
+# whenever a show is inserted, recounted whenever a show is deleted, and shows
+# whose start time has passed are moved from upcoming to past by the
+# rollover-show-counts command, meant to run periodically (e.g. hourly from
+# cron).
+
+SHOW_COUNTER_OWNERS = ((Venue, 'venue_id'), (Artist, 'artist_id'))
+
+# add delta to the upcoming or past show counter of the venue and artist of show
+def adjust_show_counters(connection, show, delta):
+  start_time = show.start_time
+  if not isinstance(start_time, datetime):
+    start_time = dateutil.parser.parse(start_time)
+  counter = 'upcoming_shows_count' if start_time >= datetime.now() else 'past_shows_count'
+  for model, key in SHOW_COUNTER_OWNERS:
+    table = model.__table__
+    connection.execute(table.update()
+      .where(table.c.id == getattr(show, key))
+      .values({counter: table.c[counter] + delta}))
+
+@event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+  adjust_show_counters(connection, show, 1)
+
+# a deleted show may have started since it was counted as upcoming without
+# having been rolled over yet, so which counter to decrement is unknown: the
+# venue and artist are recounted instead
+@event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+  for model, key in SHOW_COUNTER_OWNERS:
+    refresh_show_counters(model, key, [getattr(show, key)], connection=connection)
+
+# recount the upcoming and past shows of the venues (or artists) selected by
+# ids, a list or a subquery of ids, or of all of them when ids is None
+def refresh_show_counters(model, key, ids=None, now=None, connection=None):
+  now = now or datetime.now()
+  table = model.__table__
+  show_count = db.select([db.func.count()]).where(getattr(Show, key) == table.c.id)
+  update = table.update().values(
+    upcoming_shows_count=show_count.where(Show.start_time >= now).as_scalar(),
+    past_shows_count=show_count.where(Show.start_time < now).as_scalar())
+  if ids is not None:
+    update = update.where(table.c.id.in_(ids))
+  (connection or db.session).execute(update)
+
+# move the shows which started between since and now from the upcoming to the
+# past counters. Affected venues and artists are recounted rather than
+# decremented, so overlapping runs are harmless.
+def rollover_show_counters(since):
+  now = datetime.now()
+  for model, key in SHOW_COUNTER_OWNERS:
+    column = getattr(Show, key)
+    started = db.select([column]).where(Show.start_time >= since).where(Show.start_time < now).distinct()
+    refresh_show_counters(model, key, started, now)
+  db.session.commit()
+
+# Retire the cached pages depending on tags from a CLI command. The command runs
+# in its own process, so the pages cached in memory by the web workers are only
+# retired once RESPONSE_CACHE_TTL expires, unless they share the file store.
+def invalidate_from_cli(*tags):
+  response_cache.invalidate(*tags)
+  if not response_cache.is_shared():
+    click.echo('Warning: RESPONSE_CACHE={} is not shared with the web workers, '
+      'their cached pages may be served for up to {} seconds. Use RESPONSE_CACHE=file.'.format(
+        app.config['RESPONSE_CACHE'], app.config['RESPONSE_CACHE_TTL']), err=True)
+
+@app.cli.command('rollover-show-counts')
+@click.option('--hours', default=2, show_default=True,
+  help='Roll over the shows which started in the past number of hours, use a value larger than the schedule period.')
+@click.option('--all', 'recount_all', is_flag=True, help='Recount the shows of every venue and artist.')
+def rollover_show_counts_command(hours, recount_all):
+  if recount_all:
+    for model, key in SHOW_COUNTER_OWNERS:
+      refresh_show_counters(model, key)
+    db.session.commit()
   else:
-    date = value
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+    rollover_show_counters(datetime.now() - timedelta(hours=hours))
+  invalidate_from_cli('venues')
+
+#----------------------------------------------------------------------------#
+# Bulk Import.
+#----------------------------------------------------------------------------#
+
+# columns accepted in venue and artist import files, besides 'genres'
+IMPORT_FIELDS = {
+  Venue: ('id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+          'website', 'seeking_talent', 'seeking_description'),
+  Artist: ('id', 'name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'seeking_venue'),
+}
+
+IMPORT_GENRE_TABLES = {Venue: (venue_genres, 'venue_id'), Artist: (artist_genres, 'artist_id')}
+
+def parse_import_bool(value):
+  if isinstance(value, bool):
+    return value
+  if str(value).lower() in ('true', 't', 'yes', 'y', '1'):
+    return True
+  if str(value).lower() in ('false', 'f', 'no', 'n', '0'):
+    return False
+  raise ValueError('Invalid boolean {!r}'.format(value))
+
+# ids must fit the integer id columns
+def parse_import_id(value):
+  id = int(value)
+  if not 0 < id < 2 ** 31:
+    raise ValueError('Invalid id {!r}'.format(value))
+  return id
+
+# turn a venue or artist import record into column values and a list of genre
+# names, raising ValueError if the record is invalid
+def parse_entity_record(model, record):
+  if not isinstance(record, dict):
+    raise ValueError('Not a JSON object')
+  unknown = set(record) - set(IMPORT_FIELDS[model]) - {'genres'}
+  if unknown:
+    raise ValueError('Unknown fields {}'.format(', '.join(sorted(unknown))))
+  values = {key: value for key, value in record.items() if key != 'genres' and value not in ('', None)}
+  if not values.get('name'):
+    raise ValueError('Missing name')
+  if 'id' in values:
+    values['id'] = parse_import_id(values['id'])
+  for key in ('seeking_talent', 'seeking_venue'):
+    if key in values:
+      values[key] = parse_import_bool(values[key])
+  genres = record.get('genres') or []
+  if isinstance(genres, str):
+    genres = genres.split(',')
+  if not isinstance(genres, list) or not all(isinstance(genre, str) for genre in genres):
+    raise ValueError('Invalid genres {!r}'.format(genres))
+  genres = {normalize_genre_name(genre): genre for genre in genres if genre.strip()}
+  return values, list(genres.values())
+
+# insert a batch of venue or artist records along with their genres. Records
+# with an id are inserted with executemany, the others through the ORM since
+# their generated ids are needed to link their genres. Records whose id is
+# taken are rejected up front, and a batch rolled back by the database anyway
+# is retried one record at a time.
+def import_entity_batch(model, batch):
+  rows, rejected = [], []
+  for line_number, record in batch:
+    try:
+      rows.append((line_number, record) + parse_entity_record(model, record))
+    except (ValueError, TypeError) as e:
+      rejected.append((line_number, record, str(e)))
+
+  ids = {values['id'] for _, _, values, _ in rows if 'id' in values}
+  taken = {id for id, in db.session.query(model.id).filter(model.id.in_(ids))} if ids else set()
+  valid = []
+  for line_number, record, values, genre_names in rows:
+    if 'id' not in values:
+      valid.append((line_number, record, values, genre_names))
+    elif values['id'] in taken:
+      rejected.append((line_number, record, 'Duplicate id {}'.format(values['id'])))
+    else:
+      taken.add(values['id'])
+      valid.append((line_number, record, values, genre_names))
+
+  if not valid:
+    return 0, rejected
+  try:
+    genres = {normalize_genre_name(genre.name): genre for genre in
+      get_or_create_genres(name for _, _, _, genre_names in valid for name in genre_names)}
+    db.session.add_all(genres.values())
+    db.session.flush()
+    genre_ids = lambda genre_names: {genres[normalize_genre_name(name)].id for name in genre_names}
+
+    genre_table, key = IMPORT_GENRE_TABLES[model]
+    with_ids = [(values, genre_names) for _, _, values, genre_names in valid if 'id' in values]
+    if with_ids:
+      db.session.execute(model.__table__.insert(), [values for values, _ in with_ids])
+      genre_rows = [{key: values['id'], 'genre_id': genre_id}
+        for values, genre_names in with_ids for genre_id in genre_ids(genre_names)]
+      if genre_rows:
+        db.session.execute(genre_table.insert(), genre_rows)
+    db.session.add_all([
+      model(genres=[genres[normalize_genre_name(name)] for name in genre_names], **values)
+      for _, _, values, genre_names in valid if 'id' not in values])
+    db.session.commit()
+  except (exc.IntegrityError, exc.DataError) as e:
+    db.session.rollback()
+    if len(valid) > 1:
+      inserted, retried = import_separately(lambda batch: import_entity_batch(model, batch),
+        [(line_number, record) for line_number, record, _, _ in valid])
+      return inserted, rejected + retried
+    reason = 'Rolled back: {}'.format(e.orig)
+    return 0, rejected + [(line_number, record, reason) for line_number, record, _, _ in valid]
+  return len(valid), rejected
+
+# insert a batch of show records with executemany, rejecting shows whose
+# venue or artist does not exist or which already exist, then recount the
+# shows of the venues and artists involved. A batch rolled back by the
+# database anyway is retried one record at a time.
+def import_show_batch(batch):
+  rows, rejected = [], []
+  for line_number, record in batch:
+    try:
+      if not isinstance(record, dict):
+        raise ValueError('Not a JSON object')
+      row = {
+        'venue_id': parse_import_id(record['venue_id']),
+        'artist_id': parse_import_id(record['artist_id']),
+        'start_time': dateutil.parser.parse(record['start_time']),
+      }
+      rows.append((line_number, record, row))
+    except KeyError as e:
+      rejected.append((line_number, record, 'Missing {}'.format(e)))
+    except (ValueError, TypeError, OverflowError) as e:
+      rejected.append((line_number, record, str(e)))
+
+  venue_ids = {id for id, in db.session.query(Venue.id).filter(Venue.id.in_({row['venue_id'] for _, _, row in rows}))}
+  artist_ids = {id for id, in db.session.query(Artist.id).filter(Artist.id.in_({row['artist_id'] for _, _, row in rows}))}
+  # the shows at these venues and times, a superset of the existing shows of the batch
+  seen = {tuple(show) for show in db.session.query(Show.venue_id, Show.artist_id, Show.start_time).filter(
+    Show.venue_id.in_(venue_ids), Show.start_time.in_({row['start_time'] for _, _, row in rows}))}
+  valid = []
+  for line_number, record, row in rows:
+    show_key = (row['venue_id'], row['artist_id'], row['start_time'])
+    if row['venue_id'] not in venue_ids:
+      rejected.append((line_number, record, 'Unknown venue {}'.format(row['venue_id'])))
+    elif row['artist_id'] not in artist_ids:
+      rejected.append((line_number, record, 'Unknown artist {}'.format(row['artist_id'])))
+    elif show_key in seen:
+      rejected.append((line_number, record, 'Duplicate show'))
+    else:
+      seen.add(show_key)
+      valid.append((line_number, record, row))
+
+  if not valid:
+    return 0, rejected
+  try:
+    db.session.execute(Show.__table__.insert(), [row for _, _, row in valid])
+    refresh_show_counters(Venue, 'venue_id', {row['venue_id'] for _, _, row in valid})
+    refresh_show_counters(Artist, 'artist_id', {row['artist_id'] for _, _, row in valid})
+    db.session.commit()
+  except (exc.IntegrityError, exc.DataError) as e:
+    db.session.rollback()
+    if len(valid) > 1:
+      inserted, retried = import_separately(import_show_batch,
+        [(line_number, record) for line_number, record, _ in valid])
+      return inserted, rejected + retried
+    reason = 'Rolled back: {}'.format(e.orig)
+    return 0, rejected + [(line_number, record, reason) for line_number, record, _ in valid]
+  response_cache.invalidate(*{'venue:{}'.format(row['venue_id']) for _, _, row in valid})
+  response_cache.invalidate(*{'artist:{}'.format(row['artist_id']) for _, _, row in valid})
+  return len(valid), rejected
+
+# after inserting explicit ids, move the postgres id sequence past them
+def reset_id_sequence(model):
+  if db.engine.dialect.name == 'postgresql':
+    table = model.__tablename__
+    db.session.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+      "coalesce((SELECT max(id) FROM {0}), 1))".format(table))
+    db.session.commit()
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True, help='Number of records inserted per transaction.')
+@click.option('--rejects', type=click.File('w'), help='Write the rejected records to this file as JSON lines.')
+def import_data_command(kind, path, batch_size, rejects):
+  """Import venues, artists or shows from a CSV or JSON lines file."""
+  if kind == 'shows':
+    import_batch = import_show_batch
+  else:
+    model = Venue if kind == 'venues' else Artist
+    import_batch = lambda batch: import_entity_batch(model, batch)
+  run_import(read_records(path), import_batch, batch_size, click.echo, rejects)
+  if kind != 'shows':
+    reset_id_sequence(model)
+  invalidate_from_cli('venues', 'artists', 'shows')
+
+#----------------------------------------------------------------------------#
+# Filters.
+#----------------------------------------------------------------------------#
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -132,32 +435,137 @@ def index():
 # Helper Functions.
 #----------------------------------------------------------------------------#
 
+# genres read from the database, keyed by normalized name. Entries are
+# detached copies, merged into the current session without a query.
+genre_cache = {}
+
+# spelling of each genre offered by the forms, keyed by normalized name
+CANONICAL_GENRES = {normalize_genre_name(name): name for name in validate_genres.values}
+
+@event.listens_for(Genre, 'after_insert')
+@event.listens_for(Genre, 'after_delete')
+def invalidate_genre_cache(mapper, connection, genre):
+  genre_cache.clear()
+
+# genres are marked dirty whenever their backrefs change, only a new name
+# invalidates the cache
+@event.listens_for(Genre, 'after_update')
+def invalidate_renamed_genre(mapper, connection, genre):
+  if db.inspect(genre).attrs.name.history.has_changes():
+    genre_cache.clear()
+
+# given a list of genre names, return the corresponding Genre objects, matching
+# names exactly once normalized and ignoring blank names. Genres that do not
+# exist yet are created. A name missing from the cache reloads every genre in
+# one query: genres are few, and normalizing the stored names in Python
+# matches them the same way as the given names, which lower() in SQL would not.
+def get_or_create_genres(genre_names):
+  names = {}
+  for name in genre_names:
+    key = normalize_genre_name(name)
+    if key:
+      names.setdefault(key, ' '.join(name.split()))
+  if any(key not in genre_cache for key in names):
+    for genre in Genre.query.order_by(Genre.id):
+      cached = Genre(id=genre.id, name=genre.name)
+      make_transient_to_detached(cached)
+      genre_cache.setdefault(normalize_genre_name(genre.name), cached)
+
+  genres = []
+  for key, name in names.items():
+    if key in genre_cache:
+      genres.append(db.session.merge(genre_cache[key], load=False))
+    else:
+      genres.append(Genre(name=CANONICAL_GENRES.get(key, name)))
+  return genres
+
 # given a model with a genres association and a list of string genres,
 # set the genres associated with the model to the corresponding instrumented
 # list of Genre objects
 def set_genre_list(model, genre_list):
-  # gets a genre by name, if no corresponding genre is found, the genre is
-  # created
-  def get_or_create_genre(genre_name):
-    genre = Genre.query.filter(Genre.name.ilike('%{}%'.format(genre_name))).first()
-    if genre:
-      return genre
-    else:
-      return Genre(name=genre_name)
-
-  model.genres.clear()
-  genre_list = [get_or_create_genre(genre) for genre in genre_list]
-  model.genres.extend(genre_list)
-
-def retrieve_upcoming_shows(filter_kwargs):
-  return Show.query.filter_by(**filter_kwargs).filter(Show.start_time >= datetime.now()).all()
+  model.genres = get_or_create_genres(genre_list)
+
+# load a venue with its genres and its shows, along with the artist of each
+# show, in a constant number of queries
+def load_venue_detail(venue_id):
+  return Venue.query.options(
+    db.selectinload(Venue.genres),
+    db.selectinload(Venue.shows).joinedload(Show.artist)
+  ).get(venue_id)
+
+# load an artist with its genres and its shows, along with the venue of each
+# show, in a constant number of queries
+def load_artist_detail(artist_id):
+  return Artist.query.options(
+    db.selectinload(Artist.genres),
+    db.selectinload(Artist.shows).joinedload(Show.venue)
+  ).get(artist_id)
+
+# retrieve the id, name, area and number of upcoming shows of every venue,
+# ordered by area so that venues sharing a city and state are adjacent
+def query_venue_listing():
+  return db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count)\
+    .order_by(Venue.state, Venue.city, Venue.id)
+
+# given rows from query_venue_listing, yield one area at a time in the format
+# expected by pages/venues.html
+def iter_venue_areas(rows):
+  for (city, state), area_rows in groupby(rows, key=lambda row: (row.city, row.state)):
+    yield {
+      "city": city,
+      "state": state,
+      "venues": [{
+        "id": row.id,
+        "name": row.name,
+        "num_upcoming_shows": row.upcoming_shows_count
+      } for row in area_rows]
+    }
 
-def retrieve_past_shows(filter_kwargs):
-  return Show.query.filter_by(**filter_kwargs).filter(Show.start_time < datetime.now()).all()
+# retrieve one page of query ordered by key_columns, starting after the row
+# whose key is cursor_values. Returns the rows and the cursor of the next
+# page, which is None on the last page. Filtering on the sort key instead of
+# skipping rows with OFFSET makes deep pages as cheap as the first one.
+def paginate_keyset(query, key_columns, cursor_values=None, page_size=LISTING_PAGE_SIZE):
+  if cursor_values is not None:
+    query = query.filter(db.tuple_(*key_columns) > tuple(cursor_values))
+  rows = query.order_by(*key_columns).limit(page_size + 1).all()
+  if len(rows) <= page_size:
+    return rows, None
+  rows = rows[:page_size]
+  return rows, encode_cursor([getattr(rows[-1], column.key) for column in key_columns])
+
+# parse an id of a cursor, which must fit the integer id columns
+def parse_cursor_id(value):
+  value = int(value)
+  if not 0 <= value < 2 ** 31:
+    raise OverflowError('Cursor id {} out of range'.format(value))
+  return value
+
+# read the cursor of the requested page from the 'after' query argument,
+# converting each value with the matching parser
+def request_cursor(*parsers):
+  cursor = request.args.get('after')
+  if not cursor:
+    return None
+  try:
+    values = decode_cursor(cursor)
+    if len(values) != len(parsers):
+      raise ValueError('Invalid cursor {}'.format(cursor))
+    return [parse(value) for parse, value in zip(parsers, values)]
+  except (ValueError, TypeError, OverflowError):
+    abort(400)
+
+# render a template lazily so that it can be sent to the client as it is
+# generated, rather than after the whole page has been built
+def stream_template(template_name, **context):
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(5)
+  return stream
 
 def transform_artist_detail(artist):
-    past_shows = retrieve_past_shows({"artist": artist})
-    upcoming_shows = retrieve_upcoming_shows({"artist": artist})
+    past_shows, upcoming_shows = partition_shows(artist.shows)
     return {
         "id": artist.id,
         "name": artist.name,
@@ -178,58 +586,33 @@ def transform_artist_detail(artist):
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@response_cache.cached('venues')
 def venues():
-
-  all_venues = Venue.query.all()
-
-  data = []
-
-  for venue in all_venues:
-    was_added = False
-    # Add num_upcoming_shows
-    parsed_venue = {
-      "id": venue.id,
-      "name": venue.name,
-      "num_upcoming_shows": len(retrieve_upcoming_shows({"venue": venue}))
-    }
-    for i in range(len(data)):
-      location = data[i]
-      if location["city"] == venue.city and location["state"] == venue.state:        
-        data[i]["venues"].append(parsed_venue)
-        was_added = True
-
-    if not was_added:    
-      data.append({
-        "city": venue.city,
-        "state": venue.state,
-        "venues": [
-          parsed_venue
-        ]
-      })
-         
-  return render_template('pages/venues.html', areas=data);
+  areas = iter_venue_areas(query_venue_listing().yield_per(VENUE_LISTING_BATCH_SIZE))
+  return Response(stream_with_context(stream_template('pages/venues.html', areas=areas)))
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
 
   search_term=request.form.get('search_term', '')
 
-  matching_venues= Venue.query.filter(Venue.name.ilike('%{}%'.format(search_term))).all()
+  matching_venues = search_by_name(db, Venue, search_term)
 
   response={
     "count": len(matching_venues),
-    "data": [{"id": venue.id, "name": venue.name, "num_upcoming_shows": len(retrieve_upcoming_shows({ "venue":venue }))} for venue in matching_venues]
+    "data": [{"id": venue.id, "name": venue.name, "num_upcoming_shows": venue.upcoming_shows_count} for venue in matching_venues]
   }
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@response_cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
 
-  venue = Venue.query.get(venue_id)
+  venue = load_venue_detail(venue_id)
   if not venue:
     return abort(404)
-  past_shows = retrieve_past_shows({"venue": venue })
-  upcoming_shows = retrieve_upcoming_shows({ "venue": venue })
+  past_shows, upcoming_shows = partition_shows(venue.shows)
+  response_cache.tag(*['artist:{}'.format(show.artist_id) for show in venue.shows])
   data = {
     "id": venue.id,
     "name": venue.name,
@@ -264,16 +647,16 @@ def create_venue_submission():
    key: request.form.get(key) for key in request.form if key != 'genres'
   }
   venue = Venue(**data)
-  set_genre_list(venue, request.form.getlist('genres'))
-
-  error=False
-  safe_commit_session(venue, db)
+  with UnitOfWork(db) as uow:
+    set_genre_list(venue, request.form.getlist('genres'))
+    uow.add(venue)
 
   # on successful db insert, flash success
-  if not error:
+  if not uow.error:
+    response_cache.invalidate('venues')
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   else:
-    flash('An error occurred. Venue ' + data.name + ' could not be listed.')
+    flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
   
   return render_template('pages/home.html')
 
@@ -281,19 +664,13 @@ def create_venue_submission():
 def delete_venue(venue_id):
 
   venue = Venue.query.get(venue_id)
-  error = False
-  try:
-    db.session.delete(venue)
-    db.session.commit()
-  except:
-    error = True
-    db.session.rollback()
-  finally:
-    db.session.close()
+  with UnitOfWork(db) as uow:
+    uow.delete(venue)
 
-  if error:
+  if uow.error:
     flash('An error occurred. Venue ' + venue.name + ' could not be deleted.')
   else:
+    response_cache.invalidate('venues', 'venue:{}'.format(venue_id))
     flash('Venue ' + venue.name + ' deleted successfully.')
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
@@ -302,36 +679,43 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@response_cache.cached('artists')
 def artists():
+  rows, next_cursor = paginate_keyset(
+    db.session.query(Artist.id, Artist.name), [Artist.id], request_cursor(parse_cursor_id))
   data=[{
     "id": artist.id,
     "name": artist.name,
-  } for artist in Artist.query.all()]
-  return render_template('pages/artists.html', artists=data)
+  } for artist in rows]
+  if request.args.get('format') == 'json':
+    return jsonify({"artists": data, "next_cursor": next_cursor})
+  return render_template('pages/artists.html', artists=data, next_cursor=next_cursor)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
 
   search_term=request.form.get('search_term', '')
 
-  matching_artists= Artist.query.filter(Artist.name.ilike('%{}%'.format(search_term))).all()
+  matching_artists = search_by_name(db, Artist, search_term)
 
   response={
     "count": len(matching_artists),
     "data": [{
       "id": artist.id,
       "name": artist.name,
-      "num_upcoming_shows": len(retrieve_upcoming_shows({ "artist": artist })),
+      "num_upcoming_shows": artist.upcoming_shows_count,
     } for artist in matching_artists]
   }
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
+@response_cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
 
-  artist = Artist.query.get(artist_id)
+  artist = load_artist_detail(artist_id)
   if not artist:
     return abort(404)
+  response_cache.tag(*['venue:{}'.format(show.venue_id) for show in artist.shows])
   data = transform_artist_detail(artist)
   return render_template('pages/show_artist.html', artist=data)
 
@@ -340,7 +724,7 @@ def show_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
-  artist = Artist.query.get(artist_id)
+  artist = load_artist_detail(artist_id)
   artist_data=transform_artist_detail(artist)
   return render_template('forms/edit_artist.html', form=form, artist=artist_data)
 
@@ -348,15 +732,15 @@ def edit_artist(artist_id):
 def edit_artist_submission(artist_id):
   form = request.form
   artist = Artist.query.get(artist_id)
-  artist.name = form.get('name', artist.name)
-  artist.city = form.get('city', artist.city)
-  artist.state = form.get('state', artist.state)
-  artist.phone = form.get('phone', artist.phone)
-  artist.facebook_link = form.get('facebook_link', artist.facebook_link)
-  set_genre_list(artist, form.getlist('genres'))
-  error = safe_commit_session(artist, db)
-  if not error:
-    artist = Artist.query.get(artist_id)
+  with UnitOfWork(db) as uow:
+    artist.name = form.get('name', artist.name)
+    artist.city = form.get('city', artist.city)
+    artist.state = form.get('state', artist.state)
+    artist.phone = form.get('phone', artist.phone)
+    artist.facebook_link = form.get('facebook_link', artist.facebook_link)
+    set_genre_list(artist, form.getlist('genres'))
+  if not uow.error:
+    response_cache.invalidate('artists', 'artist:{}'.format(artist_id))
     flash('Artist ' + artist.name + ' edited successfully.')
   else:
     flash('Unable to edit artist ' + artist.name)
@@ -377,19 +761,18 @@ def edit_venue_submission(venue_id):
   if not venue:
     return abort(404)
   form = request.form
-  venue.name = form.get('name', venue.name)
-  venue.phone = form.get('phone', venue.phone)
-  venue.address = form.get('address', venue.address)
-  venue.city = form.get('city', venue.city)
-  venue.state = form.get('state', venue.state)
-  venue.facebook_link = form.get('facebook_link', venue.facebook_link)
-  set_genre_list(venue, form.getlist('genres'))
-
-  error=False
-  safe_commit_session(venue, db)
+  with UnitOfWork(db) as uow:
+    venue.name = form.get('name', venue.name)
+    venue.phone = form.get('phone', venue.phone)
+    venue.address = form.get('address', venue.address)
+    venue.city = form.get('city', venue.city)
+    venue.state = form.get('state', venue.state)
+    venue.facebook_link = form.get('facebook_link', venue.facebook_link)
+    set_genre_list(venue, form.getlist('genres'))
 
   # on successful db insert, flash success
-  if not error:
+  if not uow.error:
+    response_cache.invalidate('venues', 'venue:{}'.format(venue_id))
     flash('Venue ' + form.get('name') + ' was successfully listed!')
   else:
     flash('An error occurred. Venue ' + form.get('name') + ' could not be listed.')
@@ -411,13 +794,14 @@ def create_artist_submission():
     key: form.get(key) for key in form if key != 'genres'
   }
   artist = Artist(**artist_data)
-  import pdb; pdb.set_trace()
-  set_genre_list(artist, form.getlist('genres'))
+  with UnitOfWork(db) as uow:
+    set_genre_list(artist, form.getlist('genres'))
+    uow.add(artist)
 
-  error = safe_commit_session(artist, db)
-  if error:
+  if uow.error:
     flash('Unable to add artist ' + artist_data.get("name"))
   else:
+    response_cache.invalidate('artists')
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   return render_template('pages/home.html')
 
@@ -426,10 +810,20 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@response_cache.cached('shows')
 def shows():
   # displays list of shows at /shows
-  data=[transform_show(show, "show") for show in Show.query.all()]
-  return render_template('pages/shows.html', shows=data)
+  query = Show.query.options(db.joinedload(Show.artist), db.joinedload(Show.venue))
+  rows, next_cursor = paginate_keyset(
+    query, [Show.start_time, Show.venue_id, Show.artist_id],
+    request_cursor(dateutil.parser.parse, parse_cursor_id, parse_cursor_id))
+  data=[transform_show(show, "show") for show in rows]
+  response_cache.tag(*['venue:{}'.format(show.venue_id) for show in rows])
+  response_cache.tag(*['artist:{}'.format(show.artist_id) for show in rows])
+  if request.args.get('format') == 'json':
+    return jsonify({"shows": data, "next_cursor": next_cursor})
+  start_times = format_datetimes([show["start_time"] for show in data], 'full')
+  return render_template('pages/shows.html', shows=data, start_times=start_times, next_cursor=next_cursor)
 
 @app.route('/shows/create')
 def create_shows():
@@ -443,14 +837,55 @@ def create_show_submission():
   form = request.form
   show = Show(artist_id=form.get('artist_id'), venue_id=form.get('venue_id'), start_time=form.get('start_time'))
 
-  error = safe_commit_session(show,db)
-  if error:
+  with UnitOfWork(db) as uow:
+    uow.add(show)
+  if uow.error:
     flash('Unable to add show')
   else:
+    response_cache.invalidate('shows', 'venues',
+      'venue:{}'.format(form.get('venue_id')), 'artist:{}'.format(form.get('artist_id')))
     # on successful db insert, flash success
     flash('Show was successfully listed!')
   return render_template('pages/home.html')
 
+#  Pool metrics
+#  ----------------------------------------------------------------
+
+@app.route('/debug/pool')
+def pool_status():
+  # enabled by POOL_METRICS, which defaults to the debug mode like the SQL profiler
+  if not app.config.get('POOL_METRICS', app.debug):
+    return abort(404)
+  return jsonify(pool_metrics.snapshot(db.engine.pool))
+
+#  Export
+#  ----------------------------------------------------------------
+
+EXPORT_MODELS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+
+@app.route('/api/<any(venues, artists, shows):kind>')
+def export(kind):
+  # streams every row of a table as JSON lines, optionally restricted to the
+  # comma separated columns of the 'fields' query argument. Rows are read
+  # through a server side cursor so memory use does not grow with the table.
+  model = EXPORT_MODELS[kind]
+  columns = model.__table__.columns
+  fields = request.args.get('fields')
+  fields = fields.split(',') if fields else columns.keys()
+  if any(field not in columns for field in fields):
+    return abort(400)
+
+  rows = db.session.query(*[columns[field] for field in fields])\
+    .order_by(*model.__table__.primary_key.columns)\
+    .execution_options(stream_results=True)\
+    .yield_per(EXPORT_BATCH_SIZE)
+  chunks = ndjson_chunks(rows, fields)
+  headers = {'Vary': 'Accept-Encoding'}
+  if 'gzip' in request.accept_encodings:
+    chunks = gzip_chunks(chunks)
+    headers['Content-Encoding'] = 'gzip'
+  return Response(stream_with_context(chunks), mimetype='application/x-ndjson', headers=headers)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -461,13 +896,14 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
     app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    stop_file_logging = start_file_logging(
+        app.logger,
+        app.config['LOG_FILE'],
+        max_bytes=app.config['LOG_MAX_BYTES'],
+        backup_count=app.config['LOG_BACKUP_COUNT'],
+        sample_rate=app.config['LOG_INFO_SAMPLE_RATE'],
+    )
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
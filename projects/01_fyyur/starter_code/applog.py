@@ -0,0 +1,99 @@
+import atexit
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from collections import OrderedDict
+from threading import Lock
+
+#----------------------------------------------------------------------------#
+# Asynchronous logging.
+#----------------------------------------------------------------------------#
+
+# Logging calls put their records on an in-memory queue and return, and a
+# listener thread writes them to a size rotated file as JSON lines, so request
+# threads never wait on disk I/O. Repeated INFO messages can be sampled, and
+# the queue is drained into the file when the process exits.
+
+
+# Write a record as one JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'path': record.pathname,
+            'line': record.lineno,
+        }
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry)
+
+
+# Keep one in every `rate` INFO and lower records with the same message
+# template, warnings and errors are always kept. Counts are kept for the
+# max_messages most recently logged templates only, so that messages built
+# without a template (e.g. with str.format) cannot grow them without bound.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=1, max_messages=1024):
+        super().__init__()
+        self.rate = rate
+        self.max_messages = max_messages
+        self.seen = OrderedDict()
+        self.lock = Lock()
+
+    def filter(self, record):
+        if self.rate <= 1 or record.levelno > logging.INFO or not isinstance(record.msg, str):
+            return True
+        with self.lock:
+            seen = self.seen.pop(record.msg, 0)
+            self.seen[record.msg] = seen + 1
+            if len(self.seen) > self.max_messages:
+                self.seen.popitem(last=False)
+        return seen % self.rate == 0
+
+
+# A QueueHandler which leaves the formatting to the listener thread, only
+# rendering what cannot cross threads: the arguments and the traceback. The
+# record is rendered in place rather than copied, copying it costing as much
+# as the rest of the logging call, so handlers running after this one see the
+# rendered message and a traceback already formatted into exc_text, which
+# logging.Formatter prints the same way.
+class AsyncQueueHandler(QueueHandler):
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Attach an asynchronous, rotating JSON lines file handler to a logger
+#   params: logger, path, max_bytes, backup_count, sample_rate, level
+#   returns a function which writes out the queued records and closes the
+#   file, also called at exit
+def start_file_logging(logger, path, max_bytes=10 * 1024 * 1024, backup_count=5,
+                       sample_rate=1, level=logging.INFO):
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+
+    # unlike queue.Queue, SimpleQueue.put takes no Python level lock
+    records = queue.SimpleQueue()
+    queue_handler = AsyncQueueHandler(records)
+    queue_handler.setLevel(level)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        atexit.unregister(stop)
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        file_handler.close()
+    atexit.register(stop)
+    return stop
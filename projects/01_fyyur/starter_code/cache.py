@@ -0,0 +1,253 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from urllib.parse import urlencode
+
+from flask import current_app, g, make_response, request, session
+
+#----------------------------------------------------------------------------#
+# Response cache.
+#----------------------------------------------------------------------------#
+
+# Rendered GET pages are cached per path and query arguments, and served with
+# an ETag and a Last-Modified date so that clients can revalidate with a 304.
+#
+# Every cached page depends on a set of tags such as 'venues' or 'venue:3'.
+# Each tag has a version, and a page is only served while the versions it was
+# rendered with are current. Write handlers invalidate the tags they affect,
+# which bumps their versions and retires every dependent page at once.
+#
+# Entries live in a store: MemoryStore, an in-process LRU with a TTL, or
+# FileStore, which shares entries between worker processes through a
+# directory. Tag versions never expire, so that an evicted version cannot make
+# a stale page valid again. Only FileStore sees the invalidations made by
+# other processes, such as the CLI commands.
+#
+# Streamed pages are sent as they are rendered and stored once fully sent, and
+# are then served from the cache with an ETag like other pages.
+
+# bumped by every invalidation, so that a page can tell whether any tag changed
+# while it was rendered, including tags only discovered while rendering it
+ANY_TAG = '*'
+
+
+class MemoryStore:
+    shared = False
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_version(self, tag):
+        return self.versions.get(tag, '')
+
+    def set_version(self, tag, version):
+        self.versions[tag] = version
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+class FileStore:
+    shared = True
+
+    def __init__(self, directory, ttl=300):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts[:-1], hashlib.sha1(parts[-1].encode()).hexdigest())
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    # write to a temporary file first so that readers never see partial data
+    def write(self, path, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            return self.read(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        self.write(self.path(key), value)
+
+    def get_version(self, tag):
+        try:
+            return self.read(self.path('tags', tag))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return ''
+
+    def set_version(self, tag, version):
+        self.write(self.path('tags', tag), version)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(os.path.join(self.directory, 'tags'), exist_ok=True)
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    # configure the store from RESPONSE_CACHE, one of 'memory', 'file' or
+    # 'none', RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES and
+    # RESPONSE_CACHE_DIR
+    def init_app(self, app):
+        backend = app.config.get('RESPONSE_CACHE', 'memory')
+        ttl = app.config.get('RESPONSE_CACHE_TTL', 300)
+        if backend == 'memory':
+            self.store = MemoryStore(app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1024), ttl)
+        elif backend == 'file':
+            self.store = FileStore(app.config['RESPONSE_CACHE_DIR'], ttl)
+        elif backend == 'none':
+            self.store = None
+        else:
+            raise ValueError('Unknown RESPONSE_CACHE backend {}'.format(backend))
+
+    def snapshot(self, tags):
+        return {tag: self.store.get_version(tag) for tag in tags}
+
+    def is_current(self, versions):
+        return all(self.store.get_version(tag) == version for tag, version in versions.items())
+
+    # Cache the GET responses of the decorated view
+    #   params: tags, the tags the page depends on, formatted with the view
+    #   arguments, e.g. 'venue:{venue_id}'
+    def cached(self, *tags):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                # pages carrying flashed messages are specific to one visitor
+                if self.store is None or request.method != 'GET' or session.get('_flashes'):
+                    return view(**kwargs)
+                key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+                entry = self.store.get(key)
+                if entry is not None and self.is_current(entry['versions']):
+                    return self.make_response(entry)
+
+                # take the versions before rendering, so that a write made
+                # while rendering invalidates the page
+                g.cache_tags = {tag.format(**kwargs) for tag in tags}
+                versions = self.snapshot(g.cache_tags | {ANY_TAG})
+                response = make_response(view(**kwargs))
+                if response.status_code != 200 or session.get('_flashes'):
+                    return response
+                if response.is_streamed:
+                    response.response = self.tee(key, response, versions, g.cache_tags)
+                    return response
+                entry = self.save(key, response.get_data(), response.mimetype, versions, g.cache_tags)
+                if entry is None:
+                    return response
+                return self.make_response(entry)
+            return wrapper
+        return decorator
+
+    # Store a rendered page, unless a tag was invalidated while rendering it
+    #   params: versions, the tag versions taken before rendering, and tags,
+    #   all the tags of the page including those added while rendering
+    def save(self, key, body, mimetype, versions, tags):
+        if not self.is_current(versions):
+            return None
+        # no tag changed while rendering, so the versions of the tags added
+        # while rendering are still those the page was rendered with
+        versions = dict(versions, **self.snapshot(tags - versions.keys()))
+        del versions[ANY_TAG]
+        entry = {
+            'body': body,
+            'mimetype': mimetype,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': time.time(),
+            'versions': versions,
+        }
+        self.store.set(key, entry)
+        return entry
+
+    # Return the body of a streamed page as an iterable passing its chunks
+    # through to the client, which stores the page once it has been sent in full
+    def tee(self, key, response, versions, tags):
+        source, chunks, mimetype = response.response, response.iter_encoded(), response.mimetype
+
+        def stream():
+            body = []
+            try:
+                for chunk in chunks:
+                    body.append(chunk)
+                    yield chunk
+                self.save(key, b''.join(body), mimetype, versions, tags)
+            finally:
+                if hasattr(source, 'close'):
+                    source.close()
+        return stream()
+
+    # Add tags to the page being rendered, for data discovered while rendering
+    # it, such as the artists playing at a venue
+    def tag(self, *tags):
+        if 'cache_tags' in g:
+            g.cache_tags.update(tags)
+
+    # Retire every cached page depending on any of the tags
+    def invalidate(self, *tags):
+        if self.store is None:
+            return
+        for tag in tags + (ANY_TAG,):
+            self.store.set_version(tag, uuid.uuid4().hex)
+
+    # Whether invalidations reach the other processes of the app, which they
+    # do with the file store, or when nothing is cached
+    def is_shared(self):
+        return self.store is None or self.store.shared
+
+    def clear(self):
+        if self.store is not None:
+            self.store.clear()
+
+    def make_response(self, entry):
+        response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+        response.set_etag(entry['etag'])
+        response.last_modified = entry['last_modified']
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
@@ -1,4 +1,6 @@
 import os
+import tempfile
+from dbpool import MeteredQueuePool
 SECRET_KEY = os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -10,3 +12,43 @@ DEBUG = True
 
 
 SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI', 'postgresql://postgres@localhost:5432/fyyur')
+
+# Connection pool, sized per worker process: with N gunicorn workers postgres
+# must accept N * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. Connections
+# are checked with a ping before use and recycled before server side idle
+# timeouts can close them.
+# executemany() batches, such as bulk imports, are sent to postgres as
+# multi-row VALUES statements instead of one statement per row.
+if SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        'executemany_mode': 'values',
+    }
+
+# Serve the connection pool metrics from /debug/pool, see dbpool.py
+POOL_METRICS = os.environ.get('POOL_METRICS', str(DEBUG)).lower() == 'true'
+
+# Cache rendered pages, RESPONSE_CACHE is one of 'memory', 'file' or 'none'
+# Use 'file' when running several workers, the pages cached in memory by a
+# worker are not invalidated by the writes of the others or by the CLI
+# commands until RESPONSE_CACHE_TTL expires
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fyyur-cache'))
+
+# Profile the SQL of every request, see sqlprofiler.py
+SQL_PROFILER = os.environ.get('SQL_PROFILER', str(DEBUG)).lower() == 'true'
+SQL_PROFILER_N_PLUS_ONE = int(os.environ.get('SQL_PROFILER_N_PLUS_ONE', 5))
+
+# Log file written when DEBUG is off, as JSON lines rotated by size. Only one
+# in every LOG_INFO_SAMPLE_RATE INFO messages with the same text is kept.
+LOG_FILE = os.environ.get('LOG_FILE', 'error.log')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+LOG_INFO_SAMPLE_RATE = int(os.environ.get('LOG_INFO_SAMPLE_RATE', 1))
@@ -0,0 +1,105 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+#----------------------------------------------------------------------------#
+# Connection pool metrics.
+#----------------------------------------------------------------------------#
+
+# Pool events count the connections opened, checked out, checked in and
+# invalidated. MeteredQueuePool additionally times how long each checkout
+# waits for a free connection, so that an undersized pool shows up as a shift
+# of the wait time histogram rather than as timeouts.
+
+# upper bounds, in seconds, of the wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+class PoolMetrics:
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = buckets
+        self.lock = Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.wait_counts = [0] * (len(buckets) + 1)
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def init_engine(self, engine):
+        event.listen(engine.pool, 'connect', self.on_connect)
+        event.listen(engine.pool, 'checkout', self.on_checkout)
+        event.listen(engine.pool, 'checkin', self.on_checkin)
+        event.listen(engine.pool, 'invalidate', self.on_invalidate)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checkins += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+    def observe_wait(self, seconds):
+        with self.lock:
+            self.wait_counts[bisect_left(self.buckets, seconds)] += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    # Return the current state of a pool along with the collected metrics
+    def snapshot(self, pool):
+        with self.lock:
+            waits = sum(self.wait_counts)
+            histogram = [{'le': bound, 'count': count}
+                         for bound, count in zip(self.buckets + ('+Inf',), self.wait_counts)]
+            metrics = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'wait_seconds': {
+                    'count': waits,
+                    'mean': self.wait_total / waits if waits else 0.0,
+                    'max': self.wait_max,
+                    'histogram': histogram,
+                },
+            }
+        metrics['pool'] = {'class': type(pool).__name__, 'status': pool.status()}
+        if isinstance(pool, QueuePool):
+            metrics['pool'].update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+            })
+        return metrics
+
+
+pool_metrics = PoolMetrics()
+
+
+# A QueuePool which records how long each checkout waits for a connection,
+# _do_get being the method pool implementations override to hand them out.
+# Waits are recorded in pool_metrics, subclasses can set metrics to record
+# them elsewhere.
+class MeteredQueuePool(QueuePool):
+    metrics = pool_metrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.observe_wait(time.perf_counter() - started)
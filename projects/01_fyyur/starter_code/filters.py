@@ -0,0 +1,58 @@
+from datetime import datetime
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+#----------------------------------------------------------------------------#
+# Datetime formatting.
+#----------------------------------------------------------------------------#
+
+# Pages format one start time per show, often the same few values over and
+# over. Parsed datetimes and formatted strings are memoized, and the preset
+# patterns are parsed by babel once at import time.
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+COMPILED_FORMATS = {
+    name: babel.dates.parse_pattern(pattern) for name, pattern in DATETIME_FORMATS.items()
+}
+
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=32)
+def get_locale(identifier):
+    return Locale.parse(identifier)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_datetime(value):
+    return dateutil.parser.parse(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_parsed_datetime(date, format, locale):
+    if format in COMPILED_FORMATS:
+        return COMPILED_FORMATS[format].apply(date, get_locale(locale))
+    return babel.dates.format_datetime(date, format, locale=get_locale(locale))
+
+
+# Format a datetime, or a string holding one, for display
+#   params: value, format, locale
+#   where format is 'full', 'medium', a babel preset or a babel pattern and
+#   locale defaults to the system time locale
+def format_datetime(value, format='medium', locale=None):
+    date = value if isinstance(value, datetime) else parse_datetime(value)
+    return format_parsed_datetime(date, format, locale or babel.dates.LC_TIME)
+
+
+# Format a list of datetimes at once, each distinct value is formatted once
+#   returns the formatted strings in the order of values
+def format_datetimes(values, format='medium', locale=None):
+    formatted = {value: format_datetime(value, format, locale) for value in set(values)}
+    return [formatted[value] for value in values]
@@ -0,0 +1,69 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+import filters
+
+#----------------------------------------------------------------------------#
+# Datetime formatting benchmark.
+#----------------------------------------------------------------------------#
+
+# Formats the start times of a page of shows, spread over a year on the hour,
+# with the 'full' pattern: one babel call per row as the filter used to do,
+# then format_datetimes with empty caches and again with warm caches, and
+# checks that every output matches babel.
+#
+#   usage: python filters_benchmark.py --shows 10000
+
+
+def make_start_times(count, days, seed):
+    rng = random.Random(seed)
+    start = datetime(2035, 1, 1, 12)
+    return [(start + timedelta(days=rng.randrange(days), hours=rng.randrange(12))).isoformat()
+            for _ in range(count)]
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def clear_caches():
+    filters.parse_datetime.cache_clear()
+    filters.format_parsed_datetime.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the datetime filter.')
+    parser.add_argument('--shows', type=int, default=10000, help='Number of start times.')
+    parser.add_argument('--days', type=int, default=365, help='Days the start times are spread over.')
+    parser.add_argument('--format', default='full', choices=sorted(filters.DATETIME_FORMATS))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    values = make_start_times(args.shows, args.days, args.seed)
+    pattern = filters.DATETIME_FORMATS[args.format]
+    locale = babel.dates.LC_TIME
+
+    expected, per_row = timed(lambda: [
+        babel.dates.format_datetime(dateutil.parser.parse(value), pattern, locale=locale)
+        for value in values])
+    clear_caches()
+    cold, cold_time = timed(lambda: filters.format_datetimes(values, args.format))
+    warm, warm_time = timed(lambda: filters.format_datetimes(values, args.format))
+    if not cold == warm == expected:
+        raise SystemExit('format_datetimes does not match babel')
+
+    print('{} start times, {} distinct'.format(len(values), len(set(values))))
+    print('per row babel: {:.1f}ms'.format(per_row * 1000))
+    print('cold batch:    {:.1f}ms'.format(cold_time * 1000))
+    print('warm batch:    {:.1f}ms'.format(warm_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,12 @@
+import json
+import time
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
 #----------------------------------------------------------------------------#
 # Model-independent helper functions.
 #----------------------------------------------------------------------------#
@@ -31,16 +40,154 @@ def transform_show(show, output_format="artist"):
         }
 
 
-# given a transient model and the corresponding db instance
-# commit the model to the db and return the success of the transaction
-def safe_commit_session(model, db):
-    error = False
-    try:
-        db.session.add(model)
-        db.session.commit()
-    except:
-        error = True
-        db.session.rollback()
-    finally:
-        db.session.close()
-        return error
\ No newline at end of file
+# Normalize a genre name for exact, case and whitespace insensitive lookups
+#   e.g. ' Rock  n roll' -> 'rock n roll'
+def normalize_genre_name(name):
+    return ' '.join(name.split()).lower()
+
+
+# Split shows into past and upcoming shows in a single pass
+#   returns a (past_shows, upcoming_shows) tuple
+def partition_shows(shows):
+    now = datetime.now()
+    past_shows, upcoming_shows = [], []
+    for show in shows:
+        if show.start_time >= now:
+            upcoming_shows.append(show)
+        else:
+            past_shows.append(show)
+    return past_shows, upcoming_shows
+
+
+# Group the writes made in a block into a single transaction
+#   usage: with UnitOfWork(db) as uow:
+#              uow.add(model)
+#          if uow.error: ...
+# The transaction is committed when the outermost block exits and rolled back
+# if a database error occurs, which is then reported through uow.error rather
+# than raised. A nested block that fails rolls back the whole transaction, so
+# the outer block is reported as failed too and commits nothing. Objects stay
+# loaded after the commit, so handlers can keep using them without querying
+# them again, and the commit time is logged.
+class UnitOfWork:
+    def __init__(self, db):
+        self.db = db
+        self.error = False
+
+    def __enter__(self):
+        info = self.db.session.info
+        info['unit_of_work_depth'] = info.get('unit_of_work_depth', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        session = self.db.session()
+        session.info['unit_of_work_depth'] -= 1
+        outermost = session.info['unit_of_work_depth'] == 0
+        if exc_type is not None:
+            if not issubclass(exc_type, SQLAlchemyError):
+                session.rollback()
+                if outermost:
+                    session.info.pop('unit_of_work_failed', None)
+                return False
+            self.fail(session)
+        elif session.info.get('unit_of_work_failed'):
+            # a nested block failed, drop what was written since
+            self.error = True
+            session.rollback()
+        elif outermost:
+            self.commit(session)
+        if outermost:
+            session.info.pop('unit_of_work_failed', None)
+        return True
+
+    def add(self, model):
+        self.db.session.add(model)
+
+    def delete(self, model):
+        self.db.session.delete(model)
+
+    def commit(self, session):
+        pending = len(session.new), len(session.dirty), len(session.deleted)
+        started = time.perf_counter()
+        expire_on_commit = session.expire_on_commit
+        session.expire_on_commit = False
+        try:
+            session.commit()
+        except SQLAlchemyError:
+            self.fail(session)
+            return
+        finally:
+            session.expire_on_commit = expire_on_commit
+        current_app.logger.info('Committed %d new, %d changed and %d deleted objects in %.1fms',
+                                *pending, (time.perf_counter() - started) * 1000)
+
+    def fail(self, session):
+        self.error = True
+        session.info['unit_of_work_failed'] = True
+        session.rollback()
+        current_app.logger.exception('Transaction rolled back')
+
+
+# Encode the sort key of the last row of a page as an opaque, url safe cursor
+#   params: values, the list of sort key values of the row
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+# Decode a cursor made by encode_cursor back into its list of values, raising
+# ValueError if the cursor is malformed
+def decode_cursor(cursor):
+    values = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor {}'.format(cursor))
+    return values
+
+
+# Serialize rows as JSON lines, grouped into chunks of rows_per_chunk rows
+#   params: rows, fields, rows_per_chunk
+#   where rows are tuples of values in the order of fields
+def ndjson_chunks(rows, fields, rows_per_chunk=500):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(fields, row)), default=json_default) + '\n')
+        if len(lines) == rows_per_chunk:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+# Compress a stream of text chunks into a single gzip stream
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Count the SQL statements executed on an engine while the block runs
+#   usage: with QueryCounter(db.engine) as counter: ...
+#          counter.count
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
@@ -0,0 +1,80 @@
+import csv
+import json
+import time
+from itertools import islice
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+# Records are streamed from a CSV file with a header row, or from a file of
+# JSON objects, one per line, and handed to an import function in batches.
+# The import function returns the number of records it inserted and the
+# records it rejected, and a line is reported for every batch.
+
+
+# Yield (line_number, record) pairs from a .csv file or a JSON lines file
+def read_records(path):
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # left for the import function to reject
+                    record = line.rstrip('\n')
+                yield line_number, record
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Import the records of a batch rolled back by the database one at a time, so
+# that the records it rejects do not take the rest of the batch with them
+#   returns (inserted, rejected) like import_batch
+def import_separately(import_batch, batch):
+    inserted, rejected = 0, []
+    for record in batch:
+        record_inserted, record_rejected = import_batch([record])
+        inserted += record_inserted
+        rejected.extend(record_rejected)
+    return inserted, rejected
+
+
+# Import records batch by batch
+#   params: records, import_batch, batch_size, echo, rejects
+#   where import_batch takes a list of (line_number, record) pairs and returns
+#   (inserted, rejected), rejected being a list of
+#   (line_number, record, reason) tuples, and rejects is an optional file
+#   receiving each rejected record as a JSON line
+#   returns the total number of inserted and rejected records
+def run_import(records, import_batch, batch_size=1000, echo=print, rejects=None):
+    total_inserted = total_rejected = 0
+    started = time.perf_counter()
+    for number, batch in enumerate(chunked(records, batch_size), 1):
+        batch_started = time.perf_counter()
+        inserted, rejected = import_batch(batch)
+        elapsed = time.perf_counter() - batch_started
+        echo('batch {}: {} inserted, {} rejected in {:.2f}s ({:.0f} rows/s)'.format(
+            number, inserted, len(rejected), elapsed, len(batch) / elapsed if elapsed else 0))
+        for line_number, record, reason in sorted(rejected, key=lambda rejection: rejection[0]):
+            echo('  line {}: {}'.format(line_number, reason))
+            if rejects is not None:
+                rejects.write(json.dumps({'line': line_number, 'reason': reason, 'record': record}) + '\n')
+        total_inserted += inserted
+        total_rejected += len(rejected)
+    elapsed = time.perf_counter() - started
+    echo('{} inserted, {} rejected in {:.2f}s'.format(total_inserted, total_rejected, elapsed))
+    return total_inserted, total_rejected
@@ -0,0 +1,35 @@
+"""add trigram indexes for venue and artist name search
+
+Revision ID: 1b7d2c9e4f60
+Revises: 6320509f588b
+Create Date: 2026-10-18 10:02:11.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b7d2c9e4f60'
+down_revision = '6320509f588b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # trigram indexes are postgres specific, sqlite databases get an FTS5
+    # index created in process by search.py instead
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_venues_name_trgm', 'venues', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_artists_name_trgm', 'artists', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_artists_name_trgm', table_name='artists')
+    op.drop_index('ix_venues_name_trgm', table_name='venues')
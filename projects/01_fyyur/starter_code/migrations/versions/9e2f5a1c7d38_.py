@@ -0,0 +1,32 @@
+"""add indexes for show and genre association lookups
+
+Revision ID: 9e2f5a1c7d38
+Revises: c41e8a7d2b95
+Create Date: 2026-10-18 13:15:52.611840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2f5a1c7d38'
+down_revision = 'c41e8a7d2b95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_start_time_venue_id_artist_id', 'shows', ['start_time', 'venue_id', 'artist_id'], unique=False)
+    op.create_index('ix_artist_genres_genre_id_artist_id', 'artist_genres', ['genre_id', 'artist_id'], unique=False)
+    op.create_index('ix_venue_genres_genre_id_venue_id', 'venue_genres', ['genre_id', 'venue_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_genres_genre_id_venue_id', table_name='venue_genres')
+    op.drop_index('ix_artist_genres_genre_id_artist_id', table_name='artist_genres')
+    op.drop_index('ix_shows_start_time_venue_id_artist_id', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
@@ -0,0 +1,40 @@
+"""add upcoming and past show counters to venues and artists
+
+Revision ID: c41e8a7d2b95
+Revises: 1b7d2c9e4f60
+Create Date: 2026-10-18 11:40:27.903114
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e8a7d2b95'
+down_revision = '1b7d2c9e4f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the counters, the app keeps them up to date from now on
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.execute(sa.text(
+            'UPDATE {table} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM shows '
+            'WHERE shows.{key} = {table}.id AND shows.start_time >= :now), '
+            'past_shows_count = (SELECT count(*) FROM shows '
+            'WHERE shows.{key} = {table}.id AND shows.start_time < :now)'.format(table=table, key=key)
+        ).bindparams(now=datetime.now()))
+
+
+def downgrade():
+    for table in ('artists', 'venues'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,72 @@
+import argparse
+import json
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from dbpool import MeteredQueuePool, PoolMetrics
+
+#----------------------------------------------------------------------------#
+# Connection pool load test.
+#----------------------------------------------------------------------------#
+
+# Runs concurrent threads which each check out a connection, hold it while a
+# query runs and return it, a number of times, against one or more pool sizes,
+# and prints the elapsed time and the checkout wait time metrics of each size.
+# Use it to pick DB_POOL_SIZE and DB_MAX_OVERFLOW: a pool large enough for the
+# load shows no waits beyond the first bucket.
+#
+#   usage: python pool_loadtest.py --database postgresql://localhost/fyyur \
+#              --threads 12 --pool-size 2 --pool-size 8
+
+
+def run(database, pool_size, max_overflow, threads, checkouts, hold):
+    metrics = PoolMetrics()
+    pool_class = type('LoadTestPool', (MeteredQueuePool,), {'metrics': metrics})
+    connect_args = {'check_same_thread': False} if database.startswith('sqlite') else {}
+    engine = create_engine(database, poolclass=pool_class, pool_size=pool_size,
+                           max_overflow=max_overflow, pool_timeout=60, connect_args=connect_args)
+    metrics.init_engine(engine)
+
+    def work():
+        for _ in range(checkouts):
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+                time.sleep(hold)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    snapshot = metrics.snapshot(engine.pool)
+    engine.dispose()
+    return elapsed, snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the connection pool.')
+    parser.add_argument('--database', default='sqlite:///pool_loadtest.db', help='Database URI.')
+    parser.add_argument('--pool-size', type=int, action='append', help='Pool size, may be repeated.')
+    parser.add_argument('--max-overflow', type=int, default=0, help='Connections allowed beyond the pool size.')
+    parser.add_argument('--threads', type=int, default=12, help='Number of concurrent threads.')
+    parser.add_argument('--checkouts', type=int, default=5, help='Checkouts made by each thread.')
+    parser.add_argument('--hold', type=float, default=0.02, help='Seconds each connection is held.')
+    parser.add_argument('--json', action='store_true', help='Print the full metrics as JSON.')
+    args = parser.parse_args()
+
+    for pool_size in args.pool_size or [5]:
+        elapsed, snapshot = run(args.database, pool_size, args.max_overflow,
+                                args.threads, args.checkouts, args.hold)
+        waits = snapshot['wait_seconds']
+        print('pool_size={} max_overflow={}: {:.2f}s, {} checkouts, mean wait {:.1f}ms, max {:.1f}ms'.format(
+            pool_size, args.max_overflow, elapsed, waits['count'], waits['mean'] * 1000, waits['max'] * 1000))
+        if args.json:
+            print(json.dumps(snapshot, indent=2))
+
+
+if __name__ == '__main__':
+    main()
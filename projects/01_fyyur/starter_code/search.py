@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------#
+# Indexed name search.
+#----------------------------------------------------------------------------#
+
+# Venue and artist names are searched through an index rather than a
+# sequential '%term%' scan. Both backends match the term as a case insensitive
+# substring of the name, as the ILIKE filter did, and rank names starting with
+# the term first:
+#   postgresql: trigram GIN indexes on name (see the 1b7d2c9e4f60 migration)
+#               back the ILIKE filter, other results are ranked by trigram
+#               similarity
+#   sqlite:     FTS5 trigram tables shadowing the name column are created on
+#               first use and kept in sync by triggers, other results are
+#               ranked by bm25. Terms shorter than a trigram are scanned.
+# Any other database falls back to an unranked ILIKE filter.
+
+FTS_SCHEMA = [
+    "DROP TABLE IF EXISTS {table}_fts",
+    "CREATE VIRTUAL TABLE {table}_fts USING fts5("
+    "name, content='{table}', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {table}_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {table}_fts({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER {table}_fts_update AFTER UPDATE OF name ON {table} BEGIN "
+    "INSERT INTO {table}_fts({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO {table}_fts(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')",
+]
+
+FTS_MIN_TERM_LENGTH = 3
+
+
+# Create the FTS5 index and its triggers for the given table unless they exist
+# The triggers are dropped with the table while the FTS5 table is not, so the
+# index is rebuilt whenever the triggers are missing.
+def ensure_fts_index(db, table):
+    with db.engine.begin() as connection:
+        exists = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name",
+            {"name": '{}_fts_insert'.format(table)}).first()
+        if exists:
+            return
+        for statement in FTS_SCHEMA:
+            connection.execute(statement.format(table=table))
+
+
+# Turn a user search term into an FTS5 query matching it as a substring
+#   e.g. 'the "mus' -> '"the ""mus"'
+def to_fts_query(term):
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def search_postgresql(db, model, term):
+    return model.query\
+        .filter(model.name.ilike('%{}%'.format(term)))\
+        .order_by(
+            db.case([(model.name.ilike('{}%'.format(term)), 0)], else_=1),
+            db.func.similarity(model.name, term).desc(),
+            model.name)\
+        .all()
+
+
+def search_sqlite(db, model, term):
+    if len(term) < FTS_MIN_TERM_LENGTH:
+        return search_fallback(db, model, term)
+    table = model.__tablename__
+    ensure_fts_index(db, table)
+    ranked_ids = [row[0] for row in db.session.execute(
+        "SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :query ORDER BY rank".format(table=table),
+        {"query": to_fts_query(term)})]
+    if not ranked_ids:
+        return []
+    position = {id: i for i, id in enumerate(ranked_ids)}
+    matches = model.query.filter(model.id.in_(ranked_ids)).all()
+    prefix = term.lower()
+    return sorted(matches, key=lambda match: (not match.name.lower().startswith(prefix), position[match.id]))
+
+
+def search_fallback(db, model, term):
+    return model.query.filter(model.name.ilike('%{}%'.format(term))).all()
+
+
+SEARCH_BACKENDS = {
+    'postgresql': search_postgresql,
+    'sqlite': search_sqlite,
+}
+
+
+# Search a model with an indexed name column, most relevant matches first
+#   params: db, model, term
+#   where model is a model with integer id and string name columns
+def search_by_name(db, model, term):
+    term = term.strip()
+    if not term:
+        return model.query.order_by(model.name).all()
+    backend = SEARCH_BACKENDS.get(db.engine.dialect.name, search_fallback)
+    return backend(db, model, term)
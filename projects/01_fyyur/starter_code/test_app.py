@@ -0,0 +1,588 @@
+import os
+import re
+import json
+import gzip
+import logging
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URI', 'postgresql://postgres@localhost:5432/fyyur_test')
+
+import babel.dates
+from flask import Flask
+from sqlalchemy import create_engine
+
+from applog import SamplingFilter, start_file_logging
+from cache import ResponseCache
+from dbpool import MeteredQueuePool, PoolMetrics
+from filters import DATETIME_FORMATS, format_datetime, format_datetimes
+from helpers import QueryCounter, UnitOfWork, encode_cursor
+from app import app, db, response_cache, genre_cache, get_or_create_genres, rollover_show_counters, DETAIL_PAGE_MAX_QUERIES, Venue, Artist, Genre, Show, venue_genres, artist_genres
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        app.testing = True
+        self.client = app.test_client
+        db.create_all()
+        response_cache.clear()
+        genre_cache.clear()
+        self.seed_db()
+
+    def seed_db(self):
+        venue = Venue(name="The Musical Hop", city="San Francisco", state="CA")
+        artist = Artist(name="Guns N Petals", city="San Francisco", state="CA")
+        show = Show(venue=venue, artist=artist, start_time=datetime(2035, 4, 1, 20))
+        db.session.add_all([venue, artist, show])
+        db.session.commit()
+        self.venue_id = venue.id
+        self.artist_id = artist.id
+        db.session.remove()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+
+    def explain(self, query):
+        """Return the query plan of a query as a single string."""
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        params = compiled.params
+        if compiled.positional:
+            params = tuple(params[name] for name in compiled.positiontup)
+        with db.engine.connect() as connection:
+            if db.engine.dialect.name == 'postgresql':
+                # the test tables are tiny, make the planner prefer an index
+                connection.execute('SET enable_seqscan = off')
+                prefix = 'EXPLAIN '
+            else:
+                prefix = 'EXPLAIN QUERY PLAN '
+            rows = connection.execute(prefix + str(compiled), params)
+            return ' '.join(str(row) for row in rows)
+
+    # Indexes
+
+    def test_upcoming_shows_of_artist_use_index(self):
+        plan = self.explain(Show.query.filter(
+            Show.artist_id == 1, Show.start_time >= datetime.now()))
+        self.assertIn('ix_shows_artist_id_start_time', plan)
+
+    def test_upcoming_shows_of_venue_use_index(self):
+        plan = self.explain(Show.query.filter(
+            Show.venue_id == 1, Show.start_time >= datetime.now()))
+        self.assertIn('ix_shows_venue_id_start_time', plan)
+
+    def test_show_listing_uses_index(self):
+        plan = self.explain(Show.query.order_by(
+            Show.start_time, Show.venue_id, Show.artist_id).limit(50))
+        self.assertIn('ix_shows_start_time_venue_id_artist_id', plan)
+
+    def test_venues_of_genre_use_index(self):
+        plan = self.explain(db.session.query(venue_genres.c.venue_id).filter(
+            venue_genres.c.genre_id == 1))
+        self.assertIn('ix_venue_genres_genre_id_venue_id', plan)
+
+    def test_artists_of_genre_use_index(self):
+        plan = self.explain(db.session.query(artist_genres.c.artist_id).filter(
+            artist_genres.c.genre_id == 1))
+        self.assertIn('ix_artist_genres_genre_id_artist_id', plan)
+
+    # Bulk import
+
+    def import_records(self, kind, records):
+        """Run the import-data command on JSON lines, return its output."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, kind + '.jsonl')
+            with open(path, 'w') as f:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+            result = app.test_cli_runner().invoke(args=['import-data', kind, path])
+        db.session.remove()
+        self.assertIsNone(result.exception, result.output)
+        return result.output
+
+    def test_import_venues_with_genres(self):
+        output = self.import_records('venues', [
+            {"name": "Park Square", "city": "Oakland", "genres": "Jazz, Folk"},
+            {"id": 100, "name": "The Dueling Pianos", "genres": ["Jazz"]},
+        ])
+        self.assertIn('2 inserted, 0 rejected', output)
+        venue = Venue.query.get(100)
+        self.assertEqual([genre.name for genre in venue.genres], ["Jazz"])
+        self.assertEqual(Genre.query.count(), 2)
+
+    def test_import_rejects_taken_ids(self):
+        output = self.import_records('artists', [
+            {"id": self.artist_id, "name": "Guns N Petals"},
+            {"id": 100, "name": "Matt Quevedo"},
+            {"id": 100, "name": "The Wild Sax Band"},
+        ])
+        self.assertIn('1 inserted, 2 rejected', output)
+        self.assertIn('line 1: Duplicate id {}'.format(self.artist_id), output)
+        self.assertIn('line 3: Duplicate id 100', output)
+        self.assertEqual(Artist.query.get(100).name, "Matt Quevedo")
+
+    def test_import_rejects_invalid_genres(self):
+        output = self.import_records('venues', [
+            {"name": "Park Square", "genres": [1]},
+            {"name": "The Dueling Pianos", "genres": {"name": "Jazz"}},
+            {"name": "The Musical Hop 2", "genres": ["Jazz"]},
+        ])
+        self.assertIn('1 inserted, 2 rejected', output)
+        self.assertIn('line 1: Invalid genres [1]', output)
+
+    def test_import_rejects_out_of_range_ids(self):
+        output = self.import_records('shows', [
+            {"venue_id": 2 ** 70, "artist_id": self.artist_id, "start_time": "2036-01-01T20:00:00"},
+        ])
+        self.assertIn('0 inserted, 1 rejected', output)
+
+    def test_import_rejects_existing_shows(self):
+        output = self.import_records('shows', [
+            {"venue_id": self.venue_id, "artist_id": self.artist_id, "start_time": "2035-04-01T20:00:00"},
+            {"venue_id": self.venue_id, "artist_id": self.artist_id, "start_time": "2036-01-01T20:00:00"},
+        ])
+        self.assertIn('1 inserted, 1 rejected', output)
+        self.assertIn('line 1: Duplicate show', output)
+        self.assertEqual(Venue.query.get(self.venue_id).upcoming_shows_count, 2)
+
+    def test_import_retries_rolled_back_batch_by_record(self):
+        # a constraint only the database knows about
+        db.session.execute('CREATE UNIQUE INDEX ix_test_venues_name ON venues (name)')
+        db.session.commit()
+        output = self.import_records('venues', [
+            {"name": "Park Square"},
+            {"name": "The Musical Hop"},
+            {"name": "The Dueling Pianos"},
+        ])
+        self.assertIn('2 inserted, 1 rejected', output)
+        self.assertIn('line 2: Rolled back', output)
+        self.assertEqual(Venue.query.count(), 3)
+
+    # Unit of work
+
+    def test_unit_of_work_commits_nested_blocks_once(self):
+        with app.app_context():
+            with UnitOfWork(db) as outer:
+                outer.add(Venue(name="Park Square"))
+                with UnitOfWork(db) as inner:
+                    inner.add(Artist(name="Matt Quevedo"))
+                self.assertEqual(Venue.query.filter_by(name="Park Square").count(), 1)
+        self.assertFalse(outer.error)
+        self.assertFalse(inner.error)
+        db.session.remove()
+        self.assertEqual((Venue.query.count(), Artist.query.count()), (2, 2))
+
+    def test_unit_of_work_nested_failure_fails_outer(self):
+        with app.app_context():
+            with UnitOfWork(db) as outer:
+                outer.add(Venue(name="Park Square"))
+                with UnitOfWork(db) as inner:
+                    # the seeded show again
+                    inner.add(Show(venue_id=self.venue_id, artist_id=self.artist_id,
+                                   start_time=datetime(2035, 4, 1, 20)))
+                    db.session.flush()
+                outer.add(Venue(name="The Dueling Pianos"))
+        self.assertTrue(inner.error)
+        self.assertTrue(outer.error)
+        db.session.remove()
+        self.assertEqual(Venue.query.count(), 1)
+
+        # the failure does not leak into the next unit
+        with app.app_context():
+            with UnitOfWork(db) as uow:
+                uow.add(Venue(name="Park Square"))
+        self.assertFalse(uow.error)
+        db.session.remove()
+        self.assertEqual(Venue.query.count(), 2)
+
+    def test_unit_of_work_raises_other_errors(self):
+        with app.app_context():
+            with self.assertRaises(KeyError):
+                with UnitOfWork(db) as uow:
+                    uow.add(Venue(name="Park Square"))
+                    raise KeyError('name')
+        db.session.remove()
+        self.assertEqual(Venue.query.count(), 1)
+
+    # Show counters
+
+    def show_counts(self):
+        """Return the (upcoming, past) counters of the seeded venue and artist."""
+        db.session.remove()
+        venue = Venue.query.get(self.venue_id)
+        artist = Artist.query.get(self.artist_id)
+        return ((venue.upcoming_shows_count, venue.past_shows_count),
+                (artist.upcoming_shows_count, artist.past_shows_count))
+
+    def start_shows(self, start_time):
+        """Move every show to start_time, as if time had passed."""
+        db.session.execute(Show.__table__.update().values(start_time=start_time))
+        db.session.commit()
+
+    def test_show_counters_on_insert(self):
+        self.assertEqual(self.show_counts(), ((1, 0), (1, 0)))
+
+        db.session.add(Show(venue_id=self.venue_id, artist_id=self.artist_id,
+                            start_time=datetime(2015, 4, 1, 20)))
+        db.session.commit()
+        self.assertEqual(self.show_counts(), ((1, 1), (1, 1)))
+
+    def test_show_counters_on_delete(self):
+        db.session.delete(Show.query.one())
+        db.session.commit()
+        self.assertEqual(self.show_counts(), ((0, 0), (0, 0)))
+
+    def test_show_counters_on_delete_before_rollover(self):
+        # counted as upcoming, started since, deleted before any rollover
+        self.start_shows(datetime.now() - timedelta(minutes=5))
+        db.session.delete(Show.query.one())
+        db.session.commit()
+        self.assertEqual(self.show_counts(), ((0, 0), (0, 0)))
+
+    def test_show_counters_rollover(self):
+        self.start_shows(datetime.now() - timedelta(minutes=5))
+        self.assertEqual(self.show_counts(), ((1, 0), (1, 0)))
+
+        rollover_show_counters(datetime.now() - timedelta(hours=2))
+        self.assertEqual(self.show_counts(), ((0, 1), (0, 1)))
+
+        # overlapping runs leave the counters unchanged
+        rollover_show_counters(datetime.now() - timedelta(hours=2))
+        self.assertEqual(self.show_counts(), ((0, 1), (0, 1)))
+
+    # Listings
+
+    def test_listing_cursor_pages(self):
+        res = self.client().get('/shows?after={}'.format(
+            encode_cursor([datetime(2030, 1, 1), 0, 0])))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Guns N Petals', res.data)
+
+    def test_listing_cursor_out_of_range(self):
+        for path, values in (('/shows', ["99999999999999999999", 1, 1]),
+                             ('/shows', ["2030-01-01T00:00:00", 99999999999999999999, 1]),
+                             ('/artists', [99999999999999999999])):
+            res = self.client().get('{}?after={}'.format(path, encode_cursor(values)))
+            self.assertEqual(res.status_code, 400, values)
+
+    def test_listing_cursor_malformed(self):
+        res = self.client().get('/artists?after=not-a-cursor')
+        self.assertEqual(res.status_code, 400)
+
+    # Detail pages
+
+    def seed_shows(self):
+        """Add genres and past and upcoming shows with other venues and artists."""
+        venue = Venue.query.get(self.venue_id)
+        artist = Artist.query.get(self.artist_id)
+        venue.genres = [Genre(name="Jazz"), Genre(name="Folk")]
+        artist.genres = venue.genres
+        for i in range(4):
+            start_time = datetime(2035 if i % 2 else 2015, 1, i + 1, 20)
+            db.session.add(Show(venue=venue, artist=Artist(name="Artist {}".format(i)), start_time=start_time))
+            db.session.add(Show(venue=Venue(name="Venue {}".format(i)), artist=artist, start_time=start_time))
+        db.session.commit()
+        db.session.remove()
+
+    def test_venue_page_query_count(self):
+        self.seed_shows()
+        with QueryCounter(db.engine) as counter:
+            res = self.client().get('/venues/{}'.format(self.venue_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Artist 3', res.data)
+        self.assertLessEqual(counter.count, DETAIL_PAGE_MAX_QUERIES)
+
+    def test_artist_page_query_count(self):
+        self.seed_shows()
+        with QueryCounter(db.engine) as counter:
+            res = self.client().get('/artists/{}'.format(self.artist_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Venue 3', res.data)
+        self.assertLessEqual(counter.count, DETAIL_PAGE_MAX_QUERIES)
+
+    # Search
+
+    def search(self, path, term):
+        """Return the names listed by a search page, in order."""
+        res = self.client().post(path, data={"search_term": term})
+        self.assertEqual(res.status_code, 200)
+        return [name.decode() for name in re.findall(rb'<h5>(.*?)</h5>', res.data)]
+
+    def test_search_venues_matches_substrings(self):
+        self.assertEqual(self.search('/venues/search', 'usical'), ["The Musical Hop"])
+        self.assertEqual(self.search('/venues/search', 'MUSICAL HOP'), ["The Musical Hop"])
+        self.assertEqual(self.search('/venues/search', 'Ho'), ["The Musical Hop"])
+        self.assertEqual(self.search('/venues/search', 'musical pop'), [])
+
+    def test_search_artists_ranks_prefix_matches_first(self):
+        db.session.add(Artist(name="Petals of Guns", city="San Francisco", state="CA"))
+        db.session.commit()
+        self.assertEqual(self.search('/artists/search', 'petals'), ["Petals of Guns", "Guns N Petals"])
+
+    def test_search_indexes_rows_of_recreated_tables(self):
+        self.assertEqual(self.search('/venues/search', 'pian'), [])
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        db.session.add(Venue(name="Dueling Pianos", city="San Francisco", state="CA"))
+        db.session.commit()
+        self.assertEqual(self.search('/venues/search', 'pian'), ["Dueling Pianos"])
+        self.assertEqual(self.search('/venues/search', 'musical'), [])
+
+    # Datetime formatting
+
+    def test_precompiled_formats_match_babel(self):
+        start = datetime(2035, 1, 1, 0, 5)
+        dates = [start + timedelta(days=day, hours=day % 24) for day in range(0, 365, 7)]
+        for format, pattern in DATETIME_FORMATS.items():
+            for locale in ('en_US', 'de_DE'):
+                for date in dates:
+                    self.assertEqual(format_datetime(date, format, locale),
+                                     babel.dates.format_datetime(date, pattern, locale=locale))
+                    self.assertEqual(format_datetime(date.isoformat(), format, locale),
+                                     babel.dates.format_datetime(date, pattern, locale=locale))
+
+    def test_format_datetimes_keeps_order(self):
+        dates = [datetime(2035, 4, 1, 20), datetime(2035, 1, 1, 9), datetime(2035, 4, 1, 20), "2035-02-01T10:00:00"]
+        self.assertEqual(format_datetimes(dates, 'full', 'en_US'),
+                         [format_datetime(date, 'full', 'en_US') for date in dates])
+
+    # Genres
+
+    def test_genres_match_once_normalized(self):
+        db.session.add(Genre(name=" Hip  Hop"))
+        db.session.commit()
+        genre_id = Genre.query.one().id
+
+        genres = get_or_create_genres(["hip hop", "HIP HOP ", "Hip\tHop"])
+        self.assertEqual([genre.id for genre in genres], [genre_id])
+
+    def test_genres_skip_blank_names(self):
+        genres = get_or_create_genres(["", "  ", " Rock  n  Roll "])
+        self.assertEqual([genre.name for genre in genres], ["Rock n Roll"])
+        self.assertIsNone(genres[0].id)
+
+    # Export
+
+    def test_export_selected_fields(self):
+        res = self.client().get('/api/venues?fields=id,name')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual(rows, [{"id": self.venue_id, "name": "The Musical Hop"}])
+
+    def test_export_all_fields(self):
+        res = self.client().get('/api/shows')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual(rows, [{"venue_id": self.venue_id, "artist_id": self.artist_id,
+                                 "start_time": "2035-04-01T20:00:00"}])
+
+    def test_export_gzip(self):
+        res = self.client().get('/api/artists?fields=name', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(res.data)), {"name": "Guns N Petals"})
+
+    def test_export_unknown_field(self):
+        res = self.client().get('/api/venues?fields=id,password')
+        self.assertEqual(res.status_code, 400)
+
+    # Response cache
+
+    def test_cached_page_revalidates_with_etag(self):
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers.get('ETag'))
+
+        res = self.client().get('/venues/{}'.format(self.venue_id),
+                                headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    def test_edit_invalidates_dependent_pages(self):
+        res = self.client().get('/artists/{}'.format(self.artist_id))
+        self.assertIn(b'The Musical Hop', res.data)
+
+        self.client().post('/venues/{}/edit'.format(self.venue_id), data={'name': 'The Dueling Pianos'})
+
+        res = self.client().get('/artists/{}'.format(self.artist_id))
+        self.assertIn(b'The Dueling Pianos', res.data)
+        self.assertNotIn(b'The Musical Hop', res.data)
+
+    def test_streamed_page_is_cached_once_sent(self):
+        res = self.client().get('/venues')
+        self.assertTrue(res.is_streamed)
+        self.assertIn(b'The Musical Hop', res.data)
+        self.assertIsNone(res.headers.get('ETag'))
+
+        res = self.client().get('/venues')
+        self.assertIn(b'The Musical Hop', res.data)
+        self.assertTrue(res.headers.get('ETag'))
+
+    def test_page_changed_while_rendering_is_not_cached(self):
+        test_app = Flask(__name__)
+        cache = ResponseCache(test_app)
+        renders = []
+
+        @test_app.route('/page')
+        @cache.cached('page')
+        def page():
+            renders.append(len(renders))
+            cache.tag('other')
+            if len(renders) == 1:
+                # a write made after the page read its data
+                cache.invalidate('other')
+            return 'page {}'.format(len(renders))
+
+        client = test_app.test_client()
+        self.assertEqual(client.get('/page').data, b'page 1')
+        self.assertEqual(client.get('/page').data, b'page 2')
+        self.assertEqual(client.get('/page').data, b'page 2')
+        self.assertEqual(len(renders), 2)
+
+    def test_file_store_shares_invalidations_between_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'RESPONSE_CACHE': 'file', 'RESPONSE_CACHE_DIR': directory}
+            web_app, cli_app = Flask(__name__), Flask(__name__)
+            web_app.config.update(config)
+            cli_app.config.update(config)
+            web_cache, cli_cache = ResponseCache(web_app), ResponseCache(cli_app)
+            renders = []
+
+            @web_app.route('/page')
+            @web_cache.cached('page')
+            def page():
+                renders.append(len(renders))
+                return 'page {}'.format(len(renders))
+
+            client = web_app.test_client()
+            self.assertEqual(client.get('/page').data, b'page 1')
+            self.assertEqual(client.get('/page').data, b'page 1')
+            cli_cache.invalidate('page')
+            self.assertEqual(client.get('/page').data, b'page 2')
+            self.assertTrue(cli_cache.is_shared())
+
+    def test_cli_warns_when_the_cache_is_not_shared(self):
+        result = app.test_cli_runner().invoke(args=['rollover-show-counts'])
+        self.assertIsNone(result.exception, result.output)
+        self.assertIn('RESPONSE_CACHE=memory is not shared', result.output)
+
+    # SQL profiler
+
+    def test_request_reports_sql_timing(self):
+        res = self.client().get('/venues/{}'.format(self.venue_id))
+        self.assertIn('db;dur=', res.headers.get('Server-Timing', ''))
+
+        res = self.client().get('/debug/sql')
+        profile = json.loads(res.data)['profiles'][0]
+        self.assertEqual(profile['path'], '/venues/{}'.format(self.venue_id))
+        self.assertGreater(profile['queries'], 0)
+        self.assertEqual(profile['duplicates'], [])
+
+    def test_streamed_request_profile_counts_body_queries(self):
+        res = self.client().get('/api/venues')
+        self.assertEqual(len(res.data.splitlines()), 1)
+        res.close()
+
+        res = self.client().get('/debug/sql')
+        profile = json.loads(res.data)['profiles'][0]
+        self.assertEqual(profile['path'], '/api/venues')
+        self.assertGreater(profile['queries'], 0)
+
+    # Pool metrics
+
+    def test_pool_metrics_time_checkout_waits(self):
+        metrics = PoolMetrics()
+        pool_class = type('TestPool', (MeteredQueuePool,), {'metrics': metrics})
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine('sqlite:///' + os.path.join(directory, 'pool.db'),
+                                   poolclass=pool_class, pool_size=1, max_overflow=0,
+                                   connect_args={'check_same_thread': False})
+            metrics.init_engine(engine)
+            held = threading.Event()
+
+            def hold_connection():
+                with engine.connect():
+                    held.set()
+                    time.sleep(0.2)
+
+            holder = threading.Thread(target=hold_connection)
+            holder.start()
+            held.wait()
+            with engine.connect() as connection:
+                connection.execute('SELECT 1')
+            holder.join()
+            snapshot = metrics.snapshot(engine.pool)
+            engine.dispose()
+
+        self.assertEqual((snapshot['connects'], snapshot['checkouts'], snapshot['checkins']), (1, 2, 2))
+        waits = snapshot['wait_seconds']
+        self.assertEqual(waits['count'], 2)
+        self.assertGreaterEqual(waits['max'], 0.1)
+        self.assertEqual(sum(bucket['count'] for bucket in waits['histogram']), 2)
+        # the waiting checkout lands in the 0.5s bucket
+        self.assertEqual([bucket['le'] for bucket in waits['histogram'] if bucket['count']][-1], 0.5)
+        self.assertEqual(snapshot['pool']['size'], 1)
+        self.assertEqual(snapshot['pool']['checked_out'], 0)
+
+    def test_pool_status_is_gated(self):
+        enabled = app.config.get('POOL_METRICS')
+        app.config['POOL_METRICS'] = False
+        try:
+            self.assertEqual(self.client().get('/debug/pool').status_code, 404)
+            app.config['POOL_METRICS'] = True
+            res = self.client().get('/debug/pool')
+            self.assertEqual(res.status_code, 200)
+            self.assertIn('wait_seconds', json.loads(res.data))
+        finally:
+            app.config['POOL_METRICS'] = enabled
+
+    # Logging
+
+    def test_file_logging_writes_sampled_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'error.log')
+            logger = logging.getLogger('fyyur.test')
+            logger.setLevel(logging.INFO)
+            stop = start_file_logging(logger, path, sample_rate=5)
+            for i in range(10):
+                logger.info('listing page %d', i)
+            logger.error('failed')
+            stop()
+
+            with open(path) as f:
+                entries = [json.loads(line) for line in f]
+            self.assertEqual([entry['message'] for entry in entries],
+                             ['listing page 0', 'listing page 5', 'failed'])
+
+
+    def test_file_logging_writes_tracebacks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'error.log')
+            logger = logging.getLogger('fyyur.test.exceptions')
+            stop = start_file_logging(logger, path)
+            try:
+                raise KeyError('venue')
+            except KeyError:
+                logger.exception('import of %s failed', 'venues')
+            stop()
+
+            with open(path) as f:
+                entry = json.loads(f.read())
+            self.assertEqual(entry['message'], 'import of venues failed')
+            self.assertIn("KeyError: 'venue'", entry['exc_info'])
+
+    def test_sampling_filter_keeps_recent_messages(self):
+        sampling = SamplingFilter(rate=2, max_messages=2)
+        make_record = lambda msg: logging.LogRecord('fyyur', logging.INFO, __file__, 1, msg, None, None)
+        kept = [sampling.filter(make_record(msg)) for msg in ('a', 'a', 'b', 'a', 'c', 'b')]
+        self.assertEqual(kept, [True, False, True, True, True, True])
+        self.assertEqual(list(sampling.seen), ['c', 'b'])
+
+
+if __name__ == "__main__":
+    unittest.main()
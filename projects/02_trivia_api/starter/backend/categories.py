@@ -0,0 +1,166 @@
+import hashlib
+import json
+import time
+from threading import Lock
+
+from sqlalchemy import event, func
+
+from models import Category, Question, db
+
+'''
+CategoryCache
+    the categories map, kept in memory
+
+Categories almost never change, so the {id: type} map and the serialized
+body of GET /categories are computed once and reused until the cache is
+invalidated. Every invalidation bumps the version. Changes to categories
+committed through the session invalidate the cache, and it is reloaded
+every max_age seconds to pick up changes made by other processes.
+'''
+
+
+class CategoryCache:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.lock = Lock()
+        self.version = 0
+        self.loaded_at = None
+        self.categories = {}
+        self.body = None
+
+    def load(self):
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age:
+                return self.categories, self.body
+            version = self.version
+        categories = {category.id: category.type
+                      for category in Category.query.order_by(Category.id)}
+        body = json.dumps({"categories": categories, "status": 200, "success": True})
+        with self.lock:
+            # an invalidation while loading leaves the cache empty
+            if self.version == version:
+                self.categories = categories
+                self.body = body
+                self.loaded_at = time.monotonic()
+        return categories, body
+
+    def get(self):
+        '''
+        get()
+            returns the {id: type} map of all categories
+        '''
+        return self.load()[0]
+
+    def get_body(self):
+        '''
+        get_body()
+            returns the JSON body of GET /categories
+        '''
+        return self.load()[1]
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.loaded_at = None
+
+
+category_cache = CategoryCache()
+
+
+'''
+CategoryStats
+    the question count, difficulty histogram and last modification time of
+    every category, kept in memory
+
+The statistics are computed with one aggregate query and serialized once,
+along with an ETag derived from the body, so that polling clients get a 304
+until something changes. Every write to categories or questions committed
+through the session bumps the version and drops the statistics, and they are
+recomputed at least every max_age seconds to pick up the writes of other
+processes.
+'''
+
+
+class CategoryStats:
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.lock = Lock()
+        self.version = 0
+        self.loaded_at = None
+        self.stats = None
+
+    def compute(self):
+        categories = {}
+        last_modified_times = []
+        rows = db.session.query(
+            Category.id, Category.type, Category.last_modified,
+            Question.difficulty, func.count(Question.id)
+        ).outerjoin(Question, Question.category_id == Category.id).group_by(
+            Category.id, Category.type, Category.last_modified, Question.difficulty
+        ).order_by(Category.id, Question.difficulty)
+        for category_id, category_type, last_modified, difficulty, count in rows:
+            if last_modified:
+                last_modified_times.append(last_modified)
+            category = categories.setdefault(category_id, {
+                "type": category_type,
+                "total_questions": 0,
+                "difficulty": {},
+                "last_modified": last_modified.isoformat() + "Z" if last_modified else None,
+            })
+            if count:
+                category["total_questions"] += count
+                category["difficulty"][str(difficulty)] = count
+        body = json.dumps({"categories": categories, "status": 200, "success": True},
+                          sort_keys=True)
+        return {
+            "body": body,
+            "etag": hashlib.sha1(body.encode()).hexdigest(),
+            "last_modified": max(last_modified_times, default=None),
+        }
+
+    def get(self):
+        '''
+        get()
+            returns the serialized statistics as {"body", "etag", "last_modified"}
+        '''
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age:
+                return self.stats
+            version = self.version
+        stats = self.compute()
+        with self.lock:
+            if self.version == version:
+                self.stats = stats
+                self.loaded_at = time.monotonic()
+        return stats
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.loaded_at = None
+
+
+category_stats = CategoryStats()
+
+
+@event.listens_for(db.session, 'after_flush')
+def track_category_changes(session, flush_context):
+    changed = session.new | session.dirty | session.deleted
+    if any(isinstance(instance, Category) for instance in changed):
+        session.info['categories_changed'] = True
+    if any(isinstance(instance, (Category, Question)) for instance in changed):
+        session.info['category_stats_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_category_cache(session):
+    if session.info.pop('categories_changed', False):
+        category_cache.invalidate()
+    if session.info.pop('category_stats_changed', False):
+        category_stats.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_category_changes(session):
+    session.info.pop('categories_changed', None)
+    session.info.pop('category_stats_changed', None)
@@ -0,0 +1,77 @@
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from categories import category_cache
+from flaskr import create_app
+from models import Category, Question, db
+
+'''
+Category cache benchmark
+
+Times GET /categories and GET /questions with the Flask test client against
+a SQLite database of a few categories, with the category cache in use and
+with it reloaded on every request (max_age=0) as the categories used to be
+queried, and counts the queries each request runs.
+
+    usage: python category_benchmark.py --requests 2000
+'''
+
+
+def seed(categories, questions):
+    types = ['Category {}'.format(number) for number in range(categories)]
+    db.session.add_all(Category(type=type) for type in types)
+    db.session.commit()
+    ids = [category.id for category in Category.query]
+    db.session.add_all(Question(question='Question {}?'.format(number), answer='Answer',
+                                category=ids[number % len(ids)], difficulty=number % 5 + 1)
+                       for number in range(questions))
+    db.session.commit()
+
+
+def measure(client, path, requests):
+    queries = []
+
+    def listener(*args):
+        queries.append(1)
+
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        client.get(path)
+        del queries[:]
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return elapsed / requests, len(queries) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the category cache.')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint.')
+    parser.add_argument('--categories', type=int, default=6, help='Number of categories.')
+    parser.add_argument('--questions', type=int, default=20, help='Number of questions.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(directory, "trivia.db")})
+    seed(args.categories, args.questions)
+    client = app.test_client()
+
+    max_age = category_cache.max_age
+    for path in ('/categories', '/questions'):
+        category_cache.max_age = 0
+        uncached, uncached_queries = measure(client, path, args.requests)
+        category_cache.max_age = max_age
+        cached, cached_queries = measure(client, path, args.requests)
+        print('GET {:<12} {:7.0f}us -> {:5.0f}us per request, {:.0f} -> {:.0f} queries'.format(
+            path, uncached * 1e6, cached * 1e6, uncached_queries, cached_queries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import time
+from collections import Counter
+from threading import Lock
+
+from sqlalchemy import event, func
+
+from models import Question, db
+
+'''
+QuestionCounts
+    the number of questions, in total and per category, kept in memory
+
+The counts are seeded with one GROUP BY query and then follow the questions
+inserted and deleted by committed sessions, so that responses reporting
+totals do not run a COUNT. They are reconciled with the database every
+max_age seconds, which also picks up the writes of other processes.
+'''
+
+
+class QuestionCounts:
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.lock = Lock()
+        self.loaded_at = None
+        self.version = 0
+        self.counts = Counter()
+
+    def load(self):
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age:
+                return self.counts
+            version = self.version
+        counts = Counter(dict(db.session.query(
+            Question.category_id, func.count(Question.id)).group_by(Question.category_id)))
+        with self.lock:
+            # changes applied while counting leave the counts to reload
+            if self.version == version:
+                self.counts = counts
+                self.loaded_at = time.monotonic()
+        return counts
+
+    def total(self):
+        return sum(self.load().values())
+
+    def category(self, category_id):
+        return self.load()[category_id]
+
+    def apply(self, changes):
+        '''
+        apply(changes)
+            adds a Counter of {category_id: questions added or removed}
+        '''
+        with self.lock:
+            self.version += 1
+            if self.loaded_at is not None:
+                self.counts.update(changes)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.loaded_at = None
+
+
+question_counts = QuestionCounts()
+
+
+@event.listens_for(db.session, 'after_flush')
+def track_question_counts(session, flush_context):
+    changes = session.info.setdefault('question_counts', Counter())
+    changes.update(question.category_id for question in session.new
+                   if isinstance(question, Question))
+    changes.subtract(question.category_id for question in session.deleted
+                     if isinstance(question, Question))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_question_counts(session):
+    changes = session.info.pop('question_counts', None)
+    if changes:
+        question_counts.apply(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_question_counts(session):
+    session.info.pop('question_counts', None)
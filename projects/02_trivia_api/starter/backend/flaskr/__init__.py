@@ -1,38 +1,83 @@
 import os
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, Response, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy.exc import SQLAlchemyError
 
-from models import setup_db, Question, Category, db
+from models import setup_db, Question, db
+from sqlprofiler import SQLProfiler
+from categories import category_cache, category_stats
+from search import create_question_search, question_index
+from loader import read_question_records, load_questions
+from counters import question_counts
+from quiz import question_ids, create_deck_store, QuizSessions
 
 QUESTIONS_PER_PAGE = 10
 
 
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
+def paginate_questions(request, query, total=None):
+    """Return one page of a question query and the number of questions it matches.
+
+    The page is fetched with LIMIT/OFFSET and, unless it is known, the total
+    with a COUNT, so that no more than one page of rows is loaded.
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
     start = QUESTIONS_PER_PAGE * (page - 1)
-    end = start + QUESTIONS_PER_PAGE
-    return [question.format() for question in selection[start:end]]
+    if total is None:
+        total = query.order_by(None).count()
+    selection = query.order_by(Question.id).offset(
+        start).limit(QUESTIONS_PER_PAGE).all()
+    return [question.format() for question in selection], total
+
+
+def search_questions(request, question_search, term):
+    """Return one page of the questions matching a search term and the number of matches."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    ids, total = question_search.search(
+        term, QUESTIONS_PER_PAGE * (page - 1), QUESTIONS_PER_PAGE)
+    questions = {question.id: question for question in Question.query.filter(
+        Question.id.in_(ids))} if ids else {}
+    return [questions[question_id].format() for question_id in ids if question_id in questions], total
 
 
 def get_all_categories():
-    return {category.id: category.type for category in Category.query.all()}
+    return category_cache.get()
 
 
-def get_questions_by_category(category):
-    return Question.query.filter_by(category=category).all()
+def get_questions_by_category(category_id):
+    return Question.query.filter_by(category_id=category_id)
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        QUIZ_SESSION_STORE=os.environ.get("QUIZ_SESSION_STORE", "memory"),
+        QUIZ_SESSION_DB=os.environ.get("QUIZ_SESSION_DB", "quiz_sessions.db"),
+        QUESTION_SEARCH=os.environ.get("QUESTION_SEARCH", "memory"),
+    )
+    if test_config:
+        app.config.from_mapping(test_config)
 
     if test_config and test_config.get("SQLALCHEMY_DATABASE_URI"):
         setup_db(app, test_config.get("SQLALCHEMY_DATABASE_URI"))
     else:
         setup_db(app)
 
+    # the in-memory caches are loaded from the database of this app on
+    # first use
+    question_ids.clear()
+    category_cache.invalidate()
+    question_index.clear()
+    question_counts.clear()
+    category_stats.invalidate()
+
+    SQLProfiler(app)
+    quiz_sessions = QuizSessions(create_deck_store(app.config))
+    question_search = create_question_search(app.config)
+    app.before_first_request(question_search.build)
+
     '''
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     '''
@@ -58,10 +103,17 @@ def create_app(test_config=None):
 
     @app.route("/categories")
     def home():
-        categories = {category.id: category.type
-                      for category in Category.query.all()}
-
-        return jsonify({"categories": categories, "status": 200, "success": True})
+        return Response(category_cache.get_body(), mimetype="application/json")
+
+    @app.route("/categories/stats")
+    def category_statistics():
+        stats = category_stats.get()
+        response = Response(stats["body"], mimetype="application/json")
+        response.set_etag(stats["etag"])
+        response.last_modified = stats["last_modified"]
+        # clients revalidate with If-None-Match and get a 304 until a write
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
 
     '''
     @TODO:
@@ -79,40 +131,72 @@ def create_app(test_config=None):
     @app.route("/questions", methods=["GET", "POST"])
     def questions():
         if request.method == "GET":
-            selection = Question.query.all()
-            questions = paginate_questions(request, selection)
+            questions, total_questions = paginate_questions(
+                request, Question.query, question_counts.total())
 
-            return jsonify({"questions": questions, "status": 200, "success": True, "category": None, "categories": get_all_categories(), "total_questions": len(selection)})
+            return jsonify({"questions": questions, "status": 200, "success": True, "category": None, "categories": get_all_categories(), "total_questions": total_questions})
         else:
             data = request.json
 
             searchTerm = data.get("searchTerm")
 
             if searchTerm is not None:
-                questions = paginate_questions(request, Question.query.filter(
-                    Question.question.ilike("%{}%".format(searchTerm))).all())
-                return jsonify({"questions": questions, "status": 200, "success": True, "category": None, "categories": get_all_categories()})
+                if not isinstance(searchTerm, str):
+                    return abort(400)
+                questions, total_questions = search_questions(
+                    request, question_search, searchTerm)
+                return jsonify({"questions": questions, "status": 200, "success": True, "category": None, "categories": get_all_categories(), "total_questions": total_questions})
             try:
-                category_id = data.get("category")
-
-                data["category"] = Category.query.get(category_id).type
+                data["category"] = int(data.get("category"))
+            except (TypeError, ValueError):
+                return abort(400)
+            if data["category"] not in get_all_categories():
+                return abort(400)
+            try:
+                # unknown fields raise a TypeError
                 question = Question(**data)
                 question.insert()
-
-                return jsonify({"questions": Question.query.count(), "total_questions": Question.query.count(), "status": 200, "success": True, "created": question.id})
-            except Exception:
+            except (TypeError, SQLAlchemyError):
                 db.session.rollback()
                 return abort(400)
 
+            return jsonify({"questions": question_counts.total(), "total_questions": question_counts.total(), "status": 200, "success": True, "created": question.id})
+
+    @app.route("/questions/bulk", methods=["POST"])
+    def bulk_create_questions():
+        lines = request.get_data(as_text=True).splitlines()
+        if not any(line.strip() for line in lines):
+            return abort(400)
+
+        try:
+            inserted, errors = load_questions(read_question_records(lines))
+        except ValueError:
+            return abort(400)
+        return jsonify({"inserted": inserted, "errors": errors, "total_questions": question_counts.total(), "status": 200, "success": True})
+
+    @app.cli.command("load-questions")
+    @click.argument("path", type=click.File())
+    @click.option("--batch-size", default=1000, show_default=True)
+    def load_questions_command(path, batch_size):
+        """Load questions from a JSON lines file or a trivia.psql style dump."""
+        try:
+            inserted, errors = load_questions(
+                read_question_records(path), batch_size)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        for error in errors:
+            click.echo("line {}: {}".format(error["line"], error["error"]))
+        click.echo("{} inserted, {} rejected".format(inserted, len(errors)))
+
     @app.route("/categories/<int:category_id>/questions")
     def questions_by_category(category_id):
-        category = Category.query.get(category_id)
+        categories = get_all_categories()
 
-        if not category:
+        if category_id not in categories:
             return abort(404)
-        questions = paginate_questions(
-            request, get_questions_by_category(category.type))
-        return jsonify({"questions": questions, "status": 200, "success": True, "category": category.type, "categories": get_all_categories()})
+        questions, total_questions = paginate_questions(
+            request, get_questions_by_category(category_id), question_counts.category(category_id))
+        return jsonify({"questions": questions, "status": 200, "success": True, "category": categories[category_id], "categories": categories, "total_questions": total_questions})
 
     """
     @TODO: 
@@ -131,7 +215,7 @@ def create_app(test_config=None):
             return abort(404)
 
         question.delete()
-        return jsonify({"status": 200, "success": True, "deleted": question_id, "questions": Question.query.count(), "total_questions": Question.query.count()})
+        return jsonify({"status": 200, "success": True, "deleted": question_id, "questions": question_counts.total(), "total_questions": question_counts.total()})
 
     """
     @TODO: 
@@ -147,11 +231,11 @@ def create_app(test_config=None):
     """
     @TODO: 
     Create a POST endpoint to get questions based on a search term. 
-    It should return any questions for whom the search term 
-    is a substring of the question. 
+    It should return the questions in which each word of the search term 
+    starts a word of the question, best matches first. 
 
     TEST: Search by any phrase. The questions list will update to include 
-    only question that include that string within their question. 
+    only questions with a word starting with each word of the phrase. 
     Try using the word "title" to start. 
     """
 
@@ -182,22 +266,38 @@ def create_app(test_config=None):
         try:
             previous_questions = data["previous_questions"]
             quiz_category = data["quiz_category"]
-            quiz_category_type = quiz_category["type"]
-            quiz_category_id = quiz_category["id"]
+            quiz_category_id = int(quiz_category["id"])
         except:
             return abort(400)
 
-        questions = Question.query.filter(~Question.id.in_(previous_questions))
-        if quiz_category_id != 0:
-            questions = questions.filter_by(category=quiz_category_type)
-
-        num_questions = len(questions.all())
-        random.seed()
-        if num_questions:
-            random_num = random.randrange(0, num_questions)
-            return jsonify({"question": questions.all()[random_num].format(), "status": 200, "success": True}), 200
+        question = question_ids.next_question(
+            quiz_category_id if quiz_category_id != 0 else question_ids.ALL, previous_questions)
+        if question:
+            return jsonify({"question": question.format(), "status": 200, "success": True}), 200
 
         return jsonify({"question": None, "status": 200, "success": True}), 200
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    def create_quiz_session():
+        data = request.json
+        try:
+            quiz_category = data["quiz_category"]
+            quiz_category_id = int(quiz_category["id"])
+        except:
+            return abort(400)
+
+        token, total_questions = quiz_sessions.start(
+            quiz_category_id if quiz_category_id != 0 else question_ids.ALL)
+        return jsonify({"token": token, "total_questions": total_questions, "status": 200, "success": True}), 200
+
+    @app.route("/quizzes/sessions/<token>/next")
+    def next_quiz_question(token):
+        try:
+            question, remaining = quiz_sessions.next_question(token)
+        except KeyError:
+            return abort(404)
+
+        return jsonify({"question": question.format() if question else None, "remaining": remaining, "status": 200, "success": True}), 200
     """
     @TODO: 
     Create error handlers for all expected errors 
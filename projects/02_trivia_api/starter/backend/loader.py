@@ -0,0 +1,151 @@
+import json
+import re
+from itertools import chain, islice
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from categories import category_cache, category_stats
+from counters import question_counts
+from models import Question, db, touch_categories
+from quiz import question_ids
+from search import question_index
+
+'''
+Bulk question loading
+
+Questions are read from JSON lines, one object per line, or from the COPY
+block of the questions table in a pg_dump such as trivia.psql, where the
+category is a category id. The category of a record can be a category id
+or type. Records are validated, resolved against the cached category map and
+inserted batch by batch, one transaction and one executemany statement per
+batch, and every rejected record is reported with its line number.
+'''
+
+COPY_QUESTIONS = re.compile(r'COPY (?:\w+\.)?questions \(([^)]*)\) FROM stdin;')
+COPY_ESCAPE = re.compile(r'\\(.)')
+COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v'}
+
+
+def unescape_copy_value(value):
+    if value == '\\N':
+        return None
+    return COPY_ESCAPE.sub(lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+def read_question_records(lines):
+    '''
+    read_question_records(lines)
+        yields (line_number, record) pairs from JSON lines or a pg_dump,
+        lines that are not valid JSON are yielded as strings to be rejected
+        raises ValueError when the lines are neither
+    '''
+    lines = enumerate(lines, 1)
+    for line_number, line in lines:
+        if not line.strip():
+            continue
+        lines = chain([(line_number, line)], lines)
+        if line.lstrip().startswith('{'):
+            yield from read_json_lines(lines)
+        else:
+            yield from read_dump(lines)
+        return
+
+
+def read_json_lines(lines):
+    for line_number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, line.rstrip('\r\n')
+
+
+def read_dump(lines):
+    columns = None
+    for line_number, line in lines:
+        line = line.rstrip('\r\n')
+        if columns is None:
+            match = COPY_QUESTIONS.match(line)
+            if match:
+                columns = [column.strip() for column in match.group(1).split(',')]
+        elif line == '\\.':
+            return
+        else:
+            values = [unescape_copy_value(value) for value in line.split('\t')]
+            yield line_number, dict(zip(columns, values))
+    if columns is None:
+        raise ValueError('Neither JSON lines nor a questions COPY block')
+
+
+def parse_question_record(record, categories):
+    '''
+    parse_question_record(record, categories)
+        returns the column values of a question record
+        raises ValueError when the record is invalid
+    '''
+    if not isinstance(record, dict):
+        raise ValueError('Not a JSON object')
+    row = {}
+    for field in ('question', 'answer'):
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError('Missing {}'.format(field))
+        row[field] = value.strip()
+    try:
+        row['difficulty'] = int(record.get('difficulty'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid difficulty {!r}'.format(record.get('difficulty')))
+    category = categories.get(str(record.get('category')).strip().lower())
+    if category is None:
+        raise ValueError('Unknown category {!r}'.format(record.get('category')))
+    row['category'] = category
+    return row
+
+
+def load_questions(records, batch_size=1000):
+    '''
+    load_questions(records, batch_size)
+        inserts (line_number, record) pairs in batches
+        returns the number of inserted questions and a list of
+        {"line": line_number, "error": reason} for the rejected records
+    '''
+    # categories are found by id or by type
+    categories = {}
+    for category_id, category_type in category_cache.get().items():
+        categories[str(category_id)] = category_id
+        categories[category_type.lower()] = category_id
+
+    inserted = 0
+    errors = []
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        rows = []
+        for line_number, record in batch:
+            try:
+                rows.append((line_number, parse_question_record(record, categories)))
+            except ValueError as e:
+                errors.append({"line": line_number, "error": str(e)})
+        if not rows:
+            continue
+        try:
+            db.session.execute(Question.__table__.insert(), [row for _, row in rows])
+            touch_categories(db.session.connection(), {row['category'] for _, row in rows})
+            db.session.commit()
+            inserted += len(rows)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            errors.extend({"line": line_number, "error": "Batch rolled back: {}".format(getattr(e, "orig", e))}
+                          for line_number, _ in rows)
+
+    # the inserts bypass the session, reload the in-memory ids, index,
+    # counts and statistics
+    if inserted:
+        question_ids.clear()
+        question_index.clear()
+        question_counts.clear()
+        category_stats.invalidate()
+    return inserted, errors
@@ -0,0 +1,44 @@
+--
+-- Turn questions.category into an indexed foreign key to categories.id
+--
+-- Databases created by the app stored the category type as text, databases
+-- restored from trivia.psql already hold category ids. Either way the column
+-- ends up as an integer foreign key with an index on (category, id). The
+-- migration can be run more than once.
+--
+--   psql trivia < migrations/001_question_category_fk.sql
+--
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'questions' AND column_name = 'category') <> 'integer' THEN
+        ALTER TABLE questions ADD COLUMN category_id integer;
+
+        UPDATE questions SET category_id = categories.id
+        FROM categories WHERE categories.type = questions.category;
+
+        -- ids stored as text
+        UPDATE questions SET category_id = categories.id
+        FROM categories
+        WHERE questions.category_id IS NULL AND categories.id::text = questions.category;
+
+        ALTER TABLE questions DROP COLUMN category;
+        ALTER TABLE questions RENAME COLUMN category_id TO category;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'questions'::regclass AND contype = 'f') THEN
+        ALTER TABLE questions ADD CONSTRAINT questions_category_fkey
+            FOREIGN KEY (category) REFERENCES categories (id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id);
+
+COMMIT;
@@ -0,0 +1,12 @@
+--
+-- Record when each category, or one of its questions, last changed
+--
+--   psql trivia < migrations/002_category_last_modified.sql
+--
+
+BEGIN;
+
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS last_modified timestamp
+    NOT NULL DEFAULT (now() AT TIME ZONE 'utc');
+
+COMMIT;
@@ -0,0 +1,14 @@
+--
+-- Index the words of questions.question for QUESTION_SEARCH=postgres
+--
+-- The expression must match the one searched by PostgresQuestionSearch in
+-- search.py. Tables created by the app get the index on creation, databases
+-- created before, or restored from trivia.psql, need this migration. The
+-- index is built without locking out writes, which cannot be done inside a
+-- transaction. The migration can be run more than once.
+--
+--   psql trivia < migrations/003_question_search_index.sql
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_tsv ON questions
+    USING gin (to_tsvector('simple', coalesce(question, '')));
@@ -1,5 +1,7 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, create_engine, event, inspect
+from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -26,22 +28,38 @@ def setup_db(app, database_path=database_path):
 '''
 Question
 
+The category column holds the id of the question's category, mapped as
+category_id, and the category itself is loaded as category.
 '''
 
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # category pages and quizzes select the questions of a category
+        # ordered by id
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category_id = Column('category', Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
+    category = relationship('Category', lazy='selectin')
+
     def __init__(self, question, answer, category, difficulty):
+        '''
+        category is a Category or the id of one
+        '''
         self.question = question
         self.answer = answer
-        self.category = category
+        if isinstance(category, Category):
+            self.category = category
+        else:
+            self.category_id = category
         self.difficulty = difficulty
 
     def insert(self):
@@ -60,7 +78,8 @@ class Question(db.Model):
             'id': self.id,
             'question': self.question,
             'answer': self.answer,
-            'category': self.category,
+            # the category type, as when it was stored in the question
+            'category': self.category.type if self.category else None,
             'difficulty': self.difficulty
         }
 
@@ -68,6 +87,8 @@ class Question(db.Model):
 '''
 Category
 
+last_modified is the UTC time of the last change to the category or to one
+of its questions.
 '''
 
 
@@ -76,6 +97,8 @@ class Category(db.Model):
 
     id = Column(Integer, primary_key=True)
     type = Column(String)
+    last_modified = Column(DateTime, nullable=False,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __init__(self, type):
         self.type = type
@@ -85,3 +108,28 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+touch_categories(connection, category_ids)
+    sets the last_modified time of categories whose questions changed
+'''
+
+
+def touch_categories(connection, category_ids):
+    category_ids = {category_id for category_id in category_ids if category_id is not None}
+    if category_ids:
+        connection.execute(Category.__table__.update().where(
+            Category.id.in_(category_ids)).values(last_modified=datetime.utcnow()))
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_delete')
+def touch_question_category(mapper, connection, question):
+    touch_categories(connection, [question.category_id])
+
+
+@event.listens_for(Question, 'after_update')
+def touch_question_categories(mapper, connection, question):
+    history = inspect(question).attrs.category_id.history
+    touch_categories(connection, [question.category_id] + list(history.deleted or []))
@@ -0,0 +1,310 @@
+import json
+import random
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import event
+
+from models import Question, db
+
+'''
+QuestionIds
+    the ids of the questions, kept in memory per category
+
+The ids of each category and of all questions are held in arrays, along
+with the position and the category of every id, so that a quiz step picks a random index in
+O(1) and an insert or delete updates the arrays in O(1). The array of all
+questions is kept under ALL, since None is the category of the questions
+whose category was deleted. The arrays are loaded on first use, follow the
+inserts and deletes committed through the session, and are reloaded every
+max_age seconds to pick up changes made by other processes.
+'''
+
+
+class QuestionIds:
+    # the key of the ids of all questions
+    ALL = 'all'
+    # random picks tried before falling back to a scan of the remaining ids
+    MAX_REJECTIONS = 16
+    # deleted questions skipped before reloading the ids
+    MAX_MISSING = 16
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.lock = Lock()
+        self.loaded_at = None
+        self.ids = {}
+        self.positions = {}
+        self.categories = {}
+
+    def load(self):
+        ids = {self.ALL: []}
+        categories = {}
+        for question_id, category in db.session.query(Question.id, Question.category_id):
+            ids[self.ALL].append(question_id)
+            ids.setdefault(category, []).append(question_id)
+            categories[question_id] = category
+        with self.lock:
+            self.ids = ids
+            self.categories = categories
+            self.positions = {category: {question_id: position for position, question_id in enumerate(category_ids)}
+                              for category, category_ids in ids.items()}
+            self.loaded_at = time.monotonic()
+
+    def is_loaded(self):
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+
+    def clear(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def add(self, question_id, category):
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            self.categories[question_id] = category
+            for key in (self.ALL, category):
+                positions = self.positions.setdefault(key, {})
+                if question_id not in positions:
+                    positions[question_id] = len(self.ids.setdefault(key, []))
+                    self.ids[key].append(question_id)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            if question_id not in self.categories:
+                return
+            for key in (self.ALL, self.categories.pop(question_id)):
+                positions = self.positions.get(key, {})
+                position = positions.pop(question_id, None)
+                if position is None:
+                    continue
+                # move the last id into the freed slot
+                ids = self.ids[key]
+                last = ids.pop()
+                if last != question_id:
+                    ids[position] = last
+                    positions[last] = position
+
+    def pick(self, category, previous_ids):
+        '''
+        pick(category, previous_ids)
+            returns the id of a random question of the category id, or of
+            any category when category is ALL, which is not in previous_ids,
+            or None when every question was played
+        '''
+        with self.lock:
+            ids = self.ids.get(category, [])
+            for _ in range(self.MAX_REJECTIONS):
+                if not ids:
+                    return None
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in previous_ids:
+                    return question_id
+            remaining = [question_id for question_id in ids if question_id not in previous_ids]
+        return random.choice(remaining) if remaining else None
+
+    def next_question(self, category, previous_ids):
+        '''
+        next_question(category, previous_ids)
+            returns a random unplayed question, fetched by primary key, or None
+        '''
+        if not self.is_loaded():
+            self.load()
+        previous_ids = set(previous_ids)
+        for _ in range(self.MAX_MISSING):
+            question_id = self.pick(category, previous_ids)
+            if question_id is None:
+                return None
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question
+            # deleted by another process, or in bulk
+            self.remove(question_id)
+        # many questions were deleted elsewhere, reload the ids once
+        self.load()
+        question_id = self.pick(category, previous_ids)
+        return Question.query.get(question_id) if question_id is not None else None
+
+
+question_ids = QuestionIds()
+
+
+@event.listens_for(db.session, 'after_flush')
+def track_question_changes(session, flush_context):
+    pending = session.info.setdefault('question_ids', [])
+    pending.extend((question_ids.add, question.id, question.category_id)
+                   for question in session.new if isinstance(question, Question))
+    pending.extend((question_ids.remove, question.id)
+                   for question in session.deleted if isinstance(question, Question))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_question_changes(session):
+    for apply, *args in session.info.pop('question_ids', []):
+        apply(*args)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_question_changes(session):
+    session.info.pop('question_ids', None)
+
+
+'''
+Quiz sessions
+
+A quiz session holds a shuffled deck of question ids, dealt one at a time,
+so that clients send a token instead of the list of questions played so
+far. Decks live in a deck store: MemoryDeckStore, an in-process LRU bounded
+to max_sessions, or SQLiteDeckStore, which shares decks between worker
+processes through a SQLite file. A session expires ttl seconds after its
+last use.
+'''
+
+
+class MemoryDeckStore:
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.decks = OrderedDict()
+        self.lock = Lock()
+
+    def create(self, token, deck):
+        with self.lock:
+            self.decks[token] = (time.time() + self.ttl, deck)
+            while len(self.decks) > self.max_sessions:
+                self.decks.popitem(last=False)
+
+    def deal(self, token):
+        '''
+        deal(token)
+            returns the next question id of the deck and the number of ids
+            left after it, (None, 0) once the deck is empty
+            raises KeyError when the session is unknown or expired
+        '''
+        with self.lock:
+            expires, deck = self.decks[token]
+            if expires < time.time():
+                del self.decks[token]
+                raise KeyError(token)
+            self.decks[token] = (time.time() + self.ttl, deck)
+            self.decks.move_to_end(token)
+            if not deck:
+                return None, 0
+            return deck.pop(), len(deck)
+
+
+class SQLiteDeckStore:
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS quiz_sessions ('
+                               'token TEXT PRIMARY KEY, deck TEXT NOT NULL, '
+                               'position INTEGER NOT NULL, expires REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_quiz_sessions_expires '
+                               'ON quiz_sessions (expires)')
+
+    def connect(self):
+        # transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def create(self, token, deck):
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM quiz_sessions WHERE expires < ?', (time.time(),))
+            connection.execute('INSERT INTO quiz_sessions VALUES (?, ?, ?, ?)',
+                               (token, json.dumps(deck), len(deck), time.time() + self.ttl))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def deal(self, token):
+        connection = self.connect()
+        try:
+            # lock the database so that two workers never deal the same id
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT deck, position FROM quiz_sessions '
+                                     'WHERE token = ? AND expires >= ?',
+                                     (token, time.time())).fetchone()
+            if row is None:
+                connection.execute('ROLLBACK')
+                raise KeyError(token)
+            deck, position = row
+            position = max(position - 1, 0)
+            connection.execute('UPDATE quiz_sessions SET position = ?, expires = ? WHERE token = ?',
+                               (position, time.time() + self.ttl, token))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        if row[1] == 0:
+            return None, 0
+        return json.loads(deck)[position], position
+
+
+'''
+create_deck_store(config)
+    returns the deck store selected by QUIZ_SESSION_STORE, 'memory' or
+    'sqlite', configured with QUIZ_SESSION_TTL, QUIZ_SESSION_MAX and
+    QUIZ_SESSION_DB
+'''
+
+
+def create_deck_store(config):
+    backend = config.get('QUIZ_SESSION_STORE', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', 3600)
+    if backend == 'memory':
+        return MemoryDeckStore(config.get('QUIZ_SESSION_MAX', 10000), ttl)
+    if backend == 'sqlite':
+        return SQLiteDeckStore(config.get('QUIZ_SESSION_DB', 'quiz_sessions.db'), ttl)
+    raise ValueError('Unknown QUIZ_SESSION_STORE {}'.format(backend))
+
+
+'''
+QuizSessions
+    deals the questions of quiz sessions from a deck store
+'''
+
+
+class QuizSessions:
+    def __init__(self, store):
+        self.store = store
+
+    def start(self, category):
+        '''
+        start(category)
+            shuffles the question ids of the category id, or of all questions
+            when category is QuestionIds.ALL, into a new session
+            returns the session token and the number of questions
+        '''
+        if not question_ids.is_loaded():
+            question_ids.load()
+        with question_ids.lock:
+            deck = list(question_ids.ids.get(category, []))
+        random.shuffle(deck)
+        token = secrets.token_urlsafe(16)
+        self.store.create(token, deck)
+        return token, len(deck)
+
+    def next_question(self, token):
+        '''
+        next_question(token)
+            returns the next question of the session and the number of
+            questions left, skipping questions deleted since the deal, or
+            None and the number of questions left when more than MAX_MISSING
+            were deleted in a row, so that the client asks again
+            raises KeyError when the session is unknown or expired
+        '''
+        for _ in range(QuestionIds.MAX_MISSING):
+            question_id, remaining = self.store.deal(token)
+            if question_id is None:
+                return None, 0
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question, remaining
+        return None, remaining
@@ -0,0 +1,196 @@
+import heapq
+import re
+import sys
+from bisect import bisect_left, insort
+from threading import Lock
+
+from sqlalchemy import DDL, event, func
+
+from models import Question, db
+
+'''
+Question search
+
+Questions are searched by the words of the search term: a question matches
+when each word starts one of its words, so "powerhouse cel" matches "What
+is the powerhouse of the cell?". Matches are ranked by the number of words
+matched exactly, then by the length of the question.
+
+QuestionIndex is an inverted index held in memory: every word maps to the
+set of ids of the questions containing it, and the sorted vocabulary gives
+the words starting with a prefix. It is built on the first request and kept
+up to date by the questions committed through the session.
+PostgresQuestionSearch answers the same queries from a GIN indexed tsvector
+instead, for deployments running several processes.
+'''
+
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return list(dict.fromkeys(WORD.findall((text or '').lower())))
+
+
+class QuestionIndex:
+    def __init__(self):
+        self.lock = Lock()
+        self.built = False
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+
+    def build(self, rows=None):
+        '''
+        build(rows)
+            indexes (id, question) pairs, by default every question
+        '''
+        if rows is None:
+            rows = db.session.query(Question.id, Question.question).yield_per(10000)
+        postings = {}
+        documents = {}
+        for question_id, question in rows:
+            words = tuple(sys.intern(word) for word in tokenize(question))
+            documents[question_id] = words
+            for word in words:
+                postings.setdefault(word, set()).add(question_id)
+        with self.lock:
+            self.postings = postings
+            self.vocabulary = sorted(postings)
+            self.documents = documents
+            self.built = True
+
+    def clear(self):
+        with self.lock:
+            self.built = False
+
+    def add(self, question_id, question):
+        with self.lock:
+            if not self.built:
+                return
+            self._remove(question_id)
+            words = tuple(sys.intern(word) for word in tokenize(question))
+            self.documents[question_id] = words
+            for word in words:
+                if word not in self.postings:
+                    self.postings[word] = set()
+                    insort(self.vocabulary, word)
+                self.postings[word].add(question_id)
+
+    def remove(self, question_id):
+        with self.lock:
+            self._remove(question_id)
+
+    def _remove(self, question_id):
+        for word in self.documents.pop(question_id, ()):
+            ids = self.postings[word]
+            ids.discard(question_id)
+            if not ids:
+                del self.postings[word]
+                del self.vocabulary[bisect_left(self.vocabulary, word)]
+
+    def expand(self, prefix):
+        position = bisect_left(self.vocabulary, prefix)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix):
+            yield self.vocabulary[position]
+            position += 1
+
+    def search(self, term, offset=0, limit=10):
+        '''
+        search(term, offset, limit)
+            returns the ids of one page of the questions matching term, best
+            match first, and the number of matching questions
+        '''
+        if not self.built:
+            self.build()
+        words = tokenize(term)
+        with self.lock:
+            if not words:
+                return sorted(self.documents)[offset:offset + limit], len(self.documents)
+
+            # intersect the longest, most selective, words first
+            matches = None
+            for word in sorted(words, key=len, reverse=True):
+                ids = set()
+                for indexed_word in self.expand(word):
+                    ids.update(self.postings[indexed_word] if matches is None
+                               else self.postings[indexed_word] & matches)
+                matches = ids
+                if not matches:
+                    return [], 0
+
+            exact = [self.postings.get(word, ()) for word in words]
+
+            def rank(question_id):
+                return (-sum(question_id in ids for ids in exact),
+                        len(self.documents[question_id]), question_id)
+
+            page = heapq.nsmallest(offset + limit, matches, key=rank)[offset:]
+            return page, len(matches)
+
+
+class PostgresQuestionSearch:
+    def search(self, term, offset=0, limit=10):
+        words = tokenize(term)
+        query = db.session.query(Question.id)
+        if words:
+            document = func.to_tsvector('simple', func.coalesce(Question.question, ''))
+            # each word is matched as a prefix, :* in tsquery syntax
+            match = func.to_tsquery('simple', ' & '.join(word + ':*' for word in words))
+            query = query.filter(document.op('@@')(match)).order_by(
+                func.ts_rank(document, match).desc(), Question.id)
+        else:
+            query = query.order_by(Question.id)
+        total = query.order_by(None).count()
+        ids = [question_id for question_id, in query.offset(offset).limit(limit)]
+        return ids, total
+
+    def build(self):
+        pass
+
+
+event.listen(Question.__table__, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON questions "
+    "USING gin (to_tsvector('simple', coalesce(question, '')))"
+).execute_if(dialect='postgresql'))
+
+
+question_index = QuestionIndex()
+
+
+'''
+create_question_search(config)
+    returns the search backend selected by QUESTION_SEARCH, 'memory' or
+    'postgres'
+'''
+
+
+def create_question_search(config):
+    backend = config.get('QUESTION_SEARCH', 'memory')
+    if backend == 'memory':
+        return question_index
+    if backend == 'postgres':
+        return PostgresQuestionSearch()
+    raise ValueError('Unknown QUESTION_SEARCH {}'.format(backend))
+
+
+@event.listens_for(db.session, 'after_flush')
+def track_question_text(session, flush_context):
+    pending = session.info.setdefault('question_index', [])
+    pending.extend((question.id, question.question)
+                   for question in session.new | session.dirty if isinstance(question, Question))
+    pending.extend((question.id, None)
+                   for question in session.deleted if isinstance(question, Question))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_question_text(session):
+    for question_id, question in session.info.pop('question_index', []):
+        if question is None:
+            question_index.remove(question_id)
+        else:
+            question_index.add(question_id, question)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_question_text(session):
+    session.info.pop('question_index', None)
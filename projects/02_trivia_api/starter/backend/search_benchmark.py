@@ -0,0 +1,106 @@
+import argparse
+import random
+import resource
+import sqlite3
+import statistics
+import string
+import time
+
+from search import QuestionIndex
+
+'''
+Question search benchmark
+
+Builds a QuestionIndex over synthetic questions, words drawn from a Zipf
+distributed vocabulary, and times searches for a rare word, a 4-character
+prefix, a common word and a common plus a rare word against the
+ILIKE '%word%' scan it replaced, run as a COUNT plus a LIMIT 10 page on an
+in-memory SQLite table of the same questions.
+
+    usage: python search_benchmark.py --questions 1000000
+'''
+
+
+def make_questions(count, vocabulary_size, words, seed):
+    rng = random.Random(seed)
+    # the most frequent words first
+    vocabulary = {}
+    while len(vocabulary) < vocabulary_size:
+        vocabulary[''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))] = None
+    vocabulary = list(vocabulary)
+    cum_weights = []
+    total = 0
+    for rank in range(vocabulary_size):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+    drawn = rng.choices(vocabulary, cum_weights=cum_weights, k=count * words)
+    questions = [(question_id, ' '.join(drawn[(question_id - 1) * words:question_id * words]) + '?')
+                 for question_id in range(1, count + 1)]
+    return vocabulary, questions
+
+
+def median_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def scan(connection, term):
+    # one LIKE per word, as the index matches every word
+    words = term.split()
+    where = ' AND '.join(['question LIKE ?'] * len(words))
+    patterns = ['%{}%'.format(word) for word in words]
+    total = connection.execute('SELECT COUNT(*) FROM questions WHERE ' + where, patterns).fetchone()[0]
+    connection.execute('SELECT id, question FROM questions WHERE ' + where +
+                       ' ORDER BY id LIMIT 10', patterns).fetchall()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the question search index.')
+    parser.add_argument('--questions', type=int, default=1000000, help='Number of questions.')
+    parser.add_argument('--vocabulary', type=int, default=50000, help='Number of distinct words.')
+    parser.add_argument('--words', type=int, default=8, help='Words per question.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each search, the median is printed.')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    vocabulary, questions = make_questions(args.questions, args.vocabulary, args.words, args.seed)
+
+    index = QuestionIndex()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index.build(questions)
+    print('build: {:.1f}s, +{:.0f} MB RSS'.format(
+        time.perf_counter() - started,
+        (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024))
+
+    question_id = args.questions + 1
+    add_remove = median_time(lambda: (index.add(question_id, questions[0][1]), index.remove(question_id)),
+                             args.repeat * 100)
+    print('add+remove: {:.0f}us'.format(add_remove * 1e6))
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, question TEXT)')
+    connection.executemany('INSERT INTO questions VALUES (?, ?)', questions)
+    del questions
+
+    searches = [
+        ('rare word', vocabulary[-1]),
+        ('4-char prefix', vocabulary[100][:4]),
+        ('common word', vocabulary[0]),
+        ('common + rare word', '{} {}'.format(vocabulary[0], vocabulary[-1])),
+    ]
+    for name, term in searches:
+        _, total = index.search(term)
+        indexed = median_time(lambda: index.search(term), args.repeat)
+        scanned = median_time(lambda: scan(connection, term), args.repeat)
+        print('{:<20} {:>8} matches: {:8.2f}ms vs {:8.2f}ms'.format(
+            name, total, indexed * 1000, scanned * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,9 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from counters import question_counts
+from models import setup_db, Question, Category, db
+from quiz import question_ids
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -29,9 +31,9 @@ class TriviaTestCase(unittest.TestCase):
 
     def seed_db(self):
         if not Question.query.all() or not Category.query.all():
-            q = Question(question="What is 4+2", category="Math",
-                         answer="6", difficulty=1)
             c = Category(type="Math")
+            q = Question(question="What is 4+2", category=c,
+                         answer="6", difficulty=1)
             self.db.session.add(q)
             self.db.session.add(c)
             self.db.session.commit()
@@ -56,14 +58,105 @@ class TriviaTestCase(unittest.TestCase):
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def test_get_categories_after_change(self):
+        res = self.client().get('/categories')
+        self.assertEqual(len(res.json.get("categories")), self.total_categories)
+
+        # through the session of the app, which invalidates the cache
+        category = Category(type="Art")
+        db.session.add(category)
+        db.session.commit()
+        category_id = category.id
+
+        res = self.client().get('/categories')
+        data = res.json
+        self.assertEqual(data["categories"].get(str(category_id)), "Art")
+        self.assertEqual(data.get("success"), True)
+        self.assertEqual(res.status_code, 200)
+
+    def test_category_stats(self):
+        res = self.client().get('/categories/stats')
+        data = res.json
+        stats = data["categories"][str(self.test_category_id)]
+        self.assertEqual(stats["total_questions"], 1)
+        self.assertEqual(stats["difficulty"], {"1": 1})
+        self.assertTrue(stats["last_modified"])
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/categories/stats',
+                                headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
+    def test_category_stats_change_after_write(self):
+        res = self.client().get('/categories/stats')
+        etag = res.headers["ETag"]
+
+        self.client().delete('/questions/{}'.format(self.test_question_id))
+
+        res = self.client().get('/categories/stats',
+                                headers={"If-None-Match": etag})
+        data = res.json
+        self.assertEqual(data["categories"][str(self.test_category_id)]["total_questions"], 0)
+        self.assertEqual(res.status_code, 200)
+
+    def test_question_counts_apply_on_commit(self):
+        self.assertEqual(question_counts.category(self.test_category_id), 1)
+
+        db.session.add(Question(question="What is 3+3", category=self.test_category_id,
+                                answer="6", difficulty=1))
+        db.session.commit()
+        self.assertEqual(question_counts.category(self.test_category_id), 2)
+
+        db.session.delete(Question.query.get(self.test_question_id))
+        db.session.commit()
+        self.assertEqual(question_counts.category(self.test_category_id), 1)
+        self.assertEqual(question_counts.total(), 1)
+
+    def test_question_counts_discard_on_rollback(self):
+        self.assertEqual(question_counts.total(), 1)
+
+        db.session.add(Question(question="What is 3+3", category=self.test_category_id,
+                                answer="6", difficulty=1))
+        db.session.flush()
+        db.session.rollback()
+        # a later commit does not apply the rolled back insert
+        db.session.commit()
+        self.assertEqual(question_counts.total(), 1)
+        self.assertEqual(question_counts.category(self.test_category_id), 1)
+
+    def test_question_counts_reconcile(self):
+        self.assertEqual(question_counts.total(), 1)
+        # written without the session noticing, as another process would
+        db.session.execute(Question.__table__.insert(), [
+            {"question": "What is 3+3", "answer": "6", "difficulty": 1,
+             "category": self.test_category_id}])
+        db.session.commit()
+        self.assertEqual(question_counts.total(), 1)
+
+        max_age = question_counts.max_age
+        question_counts.max_age = 0
+        try:
+            self.assertEqual(question_counts.total(), 2)
+            self.assertEqual(question_counts.category(self.test_category_id), 2)
+        finally:
+            question_counts.max_age = max_age
+
     def test_get_paginated_questions(self):
         res = self.client().get('/questions')
         data = res.json
         self.assertEqual(len(data.get('questions')), 1)
+        self.assertEqual(data.get('total_questions'), self.total_questions)
         self.assertEqual(data.get('category'), None)
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data.get('success'), True)
 
+    def test_get_questions_past_last_page(self):
+        res = self.client().get('/questions?page=1000')
+        data = res.json
+        self.assertEqual(data.get('questions'), [])
+        self.assertEqual(data.get('total_questions'), self.total_questions)
+        self.assertEqual(res.status_code, 200)
+
     def test_post_question(self):
         res = self.client().post('/questions',
                                  json={'category': self.test_category_id, "question": "What is 10+4", "answer": "14", "difficulty": 5})
@@ -73,19 +166,63 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data.get('success'), True)
 
+    def test_post_question_invalid(self):
+        for category in (9999, "Math", None):
+            res = self.client().post('/questions',
+                                     json={'category': category, "question": "What is 10+4", "answer": "14", "difficulty": 5})
+            self.assertEqual(res.json.get("message"), "Bad request")
+            self.assertEqual(res.status_code, 400)
+
+        res = self.client().post('/questions',
+                                 json={'category': self.test_category_id, "question": "What is 10+4", "rating": 5})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Question.query.count(), self.total_questions)
+
+    def test_bulk_create_questions(self):
+        lines = [
+            json.dumps({"question": "What is 3+3", "answer": "6", "difficulty": 1, "category": self.test_category_id}),
+            json.dumps({"question": "What is 5+5", "answer": "10", "difficulty": 1, "category": "Math"}),
+            json.dumps({"question": "What is 7+7", "answer": "14", "difficulty": 1, "category": "Unknown"}),
+        ]
+        res = self.client().post('/questions/bulk', data="\n".join(lines))
+        data = res.json
+        self.assertEqual(data.get("inserted"), 2)
+        self.assertEqual(data.get("errors"), [{"line": 3, "error": "Unknown category 'Unknown'"}])
+        self.assertEqual(data.get("total_questions"), self.total_questions + 2)
+        self.assertEqual(res.status_code, 200)
+
+    def test_bulk_create_questions_empty(self):
+        res = self.client().post('/questions/bulk', data="")
+        self.assertEqual(res.json.get("message"), "Bad request")
+        self.assertEqual(res.status_code, 400)
+
+    def test_bulk_create_questions_unknown_format(self):
+        for body in ("[1,2,3]", "hello world\nhow are you"):
+            res = self.client().post('/questions/bulk', data=body)
+            self.assertEqual(res.json.get("message"), "Bad request")
+            self.assertEqual(res.status_code, 400)
+
     def test_search_questions(self):
         res = self.client().post(
             '/questions', json={"searchTerm": "What is 4+2"})
         data = res.json
         self.assertEqual(len(data.get("questions")), 1)
+        self.assertEqual(data.get("total_questions"), 1)
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data.get('success'), True)
 
+    def test_search_questions_invalid_term(self):
+        for term in (5, ["What"], {"term": "What"}):
+            res = self.client().post('/questions', json={"searchTerm": term})
+            self.assertEqual(res.json.get("message"), "Bad request")
+            self.assertEqual(res.status_code, 400)
+
     def test_questions_by_category(self):
         res = self.client().get(
             '/categories/{}/questions'.format(self.test_category_id))
         data = res.json
         self.assertEqual(len(data.get("questions")), 1)
+        self.assertEqual(data.get("total_questions"), 1)
         self.assertEqual(data.get("category"), "Math")
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data.get('success'), True)
@@ -108,6 +245,108 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data.get("success"), True)
         self.assertEqual(res.status_code, 200)
 
+    def test_sql_profiler(self):
+        self.app.config["SQL_PROFILER"] = True
+        res = self.client().get('/questions')
+        self.assertIn("db;dur=", res.headers.get("Server-Timing", ""))
+
+        res = self.client().get('/debug/sql')
+        data = res.json
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["profiles"][0]["path"], "/questions")
+        self.assertTrue(data["profiles"][0]["queries"])
+
+    def test_quizzes_all_played(self):
+        res = self.client().post(
+            '/quizzes', json={"previous_questions": [self.test_question_id], "quiz_category": self.test_category.format()})
+        data = res.json
+        self.assertEqual(data.get("question"), None)
+        self.assertEqual(data.get("success"), True)
+        self.assertEqual(res.status_code, 200)
+
+    def test_quizzes_skip_questions_deleted_elsewhere(self):
+        other = Question(question="What is 3+3", category=self.test_category_id,
+                         answer="6", difficulty=1)
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+        # load the ids, then delete a question without the session noticing
+        self.client().post('/quizzes', json={"previous_questions": [], "quiz_category": {"id": 0}})
+        db.session.execute(Question.__table__.delete().where(Question.id == other_id))
+        db.session.commit()
+
+        for _ in range(5):
+            res = self.client().post(
+                '/quizzes', json={"previous_questions": [], "quiz_category": {"id": 0}})
+            self.assertEqual(res.json["question"]["id"], self.test_question_id)
+        # dropped from the arrays of its own category too
+        self.assertNotIn(other_id, question_ids.ids[self.test_category_id])
+
+    def test_quizzes_uncategorised_question(self):
+        # the category of a question is set to NULL when its category is deleted
+        other = Question(question="What is 3+3", category=None,
+                         answer="6", difficulty=1)
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+        self.client().post('/quizzes', json={"previous_questions": [], "quiz_category": {"id": 0}})
+        self.assertEqual(sorted(question_ids.ids[question_ids.ALL]),
+                         sorted([self.test_question_id, other_id]))
+
+        self.client().delete('/questions/{}'.format(other_id))
+        res = self.client().post(
+            '/quizzes', json={"previous_questions": [self.test_question_id], "quiz_category": {"id": 0}})
+        self.assertEqual(res.json.get("question"), None)
+        self.assertEqual(res.status_code, 200)
+
+    def test_quiz_session_uncategorised_question(self):
+        other = Question(question="What is 3+3", category=None,
+                         answer="6", difficulty=1)
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+        res = self.client().post('/quizzes/sessions', json={"quiz_category": {"id": 0}})
+        data = res.json
+        self.assertEqual(data.get("total_questions"), 2)
+
+        dealt = [self.client().get('/quizzes/sessions/{}/next'.format(data["token"])).json["question"]
+                 for _ in range(3)]
+        self.assertEqual(sorted(question["id"] for question in dealt[:2]),
+                         sorted([self.test_question_id, other_id]))
+        self.assertEqual(dealt[2], None)
+
+    def test_quiz_session(self):
+        res = self.client().post(
+            '/quizzes/sessions', json={"quiz_category": self.test_category.format()})
+        data = res.json
+        self.assertEqual(data.get("total_questions"), 1)
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/quizzes/sessions/{}/next'.format(data["token"]))
+        data_next = res.json
+        self.assertEqual(data_next["question"]["id"], self.test_question_id)
+        self.assertEqual(data_next.get("remaining"), 0)
+
+        res = self.client().get('/quizzes/sessions/{}/next'.format(data["token"]))
+        self.assertEqual(res.json.get("question"), None)
+        self.assertEqual(res.status_code, 200)
+
+    def test_quiz_session_not_found(self):
+        res = self.client().get('/quizzes/sessions/unknown/next')
+        self.assertEqual(res.json.get("message"), "Resource not found")
+        self.assertEqual(res.status_code, 404)
+
+    def test_questions_by_category_use_index(self):
+        query = Question.query.filter_by(
+            category_id=self.test_category_id).order_by(Question.id).limit(10)
+        compiled = query.statement.compile(dialect=self.db.engine.dialect)
+        with self.db.engine.connect() as connection:
+            # the test table is tiny, make the planner prefer an index
+            connection.execute("SET enable_seqscan = off")
+            plan = " ".join(str(row) for row in connection.execute(
+                "EXPLAIN " + str(compiled), compiled.params))
+        self.assertIn("ix_questions_category_id", plan)
+
     # Test Error Handling
 
     def test_method_not_allowed(self):
@@ -6,10 +6,12 @@ from flask_cors import CORS
 
 from .database.models import db_drop_and_create_all, setup_db, Drink
 from .auth.auth import AuthError, requires_auth
+from .sqlprofiler import SQLProfiler
 
 app = Flask(__name__)
 setup_db(app)
 CORS(app)
+SQLProfiler(app)
 
 '''
 @TODO uncomment the following line to initialize the datbase
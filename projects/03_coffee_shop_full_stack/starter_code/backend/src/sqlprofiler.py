@@ -0,0 +1,135 @@
+# This module is shared by the fyyur, trivia and coffee shop apps, which are
+# deployed separately, and is kept identical in each of them. Apply every
+# change to all three copies:
+#   projects/01_fyyur/starter_code/sqlprofiler.py
+#   projects/02_trivia_api/starter/backend/sqlprofiler.py
+#   projects/03_coffee_shop_full_stack/starter_code/backend/src/sqlprofiler.py
+
+import time
+from collections import deque
+from threading import Lock
+
+from flask import abort, current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Per-request SQL profiler.
+#----------------------------------------------------------------------------#
+
+# Every statement executed while serving a request is counted and timed
+# through the cursor execute events of SQLAlchemy. The totals are sent back in
+# a Server-Timing header, the profiles of the latest requests are served as
+# JSON from a debug endpoint, and a statement repeated more often than a
+# threshold within one request, the signature of an N+1 query pattern, is
+# logged as a warning.
+#
+# A streamed body runs its queries as it is sent, after the response headers
+# have gone out. For streamed responses the Server-Timing header only counts
+# the statements executed before the body, and the profile is recorded when the
+# response is closed, which includes those executed while streaming it, as
+# long as the body is generated within the request context (e.g. with
+# flask.stream_with_context).
+#
+# The profiler is enabled when SQL_PROFILER is true, and defaults to the
+# debug mode of the app. SQL_PROFILER_N_PLUS_ONE sets the warning threshold,
+# SQL_PROFILER_HISTORY the number of profiles kept and SQL_PROFILER_URL the
+# path of the debug endpoint.
+
+
+class SQLProfiler:
+    def __init__(self, app=None):
+        self.history = deque(maxlen=100)
+        self.lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.history = deque(maxlen=app.config.get('SQL_PROFILER_HISTORY', 100))
+        app.extensions['sql_profiler'] = self
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule(app.config.get('SQL_PROFILER_URL', '/debug/sql'),
+                         'sql_profiler', self.show_profiles)
+        # listening on the Engine class covers the engines of every app
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    def is_enabled(self):
+        return current_app.config.get('SQL_PROFILER', current_app.debug)
+
+    def start_request(self):
+        if self.is_enabled():
+            g.sql_profile = {}
+
+    def finish_request(self, response):
+        statements = g.get('sql_profile')
+        if statements is None:
+            return response
+        count, duration = sum_statements(statements)
+        response.headers.add(
+            'Server-Timing', 'db;dur={:.3f};desc="{} queries"'.format(duration * 1000, count))
+
+        profile = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+        }
+        logger = current_app.logger
+        threshold = current_app.config.get('SQL_PROFILER_N_PLUS_ONE', 5)
+        if response.is_streamed:
+            # the statements keep being counted until the body is sent
+            response.call_on_close(lambda: self.record(profile, statements, logger, threshold))
+        else:
+            g.pop('sql_profile')
+            self.record(profile, statements, logger, threshold)
+        return response
+
+    def record(self, profile, statements, logger, threshold):
+        count, duration = sum_statements(statements)
+        duplicates = sorted(
+            ({'statement': statement,
+              'count': stats['count'],
+              'duration_ms': round(stats['duration'] * 1000, 3)}
+             for statement, stats in statements.items() if stats['count'] > 1),
+            key=lambda duplicate: duplicate['count'], reverse=True)
+
+        for duplicate in duplicates:
+            if duplicate['count'] >= threshold:
+                logger.warning(
+                    'Possible N+1 query on %s %s: statement ran %d times: %s',
+                    profile['method'], profile['path'], duplicate['count'], duplicate['statement'])
+
+        with self.lock:
+            self.history.append(dict(
+                profile,
+                queries=count,
+                duration_ms=round(duration * 1000, 3),
+                duplicates=duplicates,
+            ))
+
+    # Return the profiles of the latest requests, newest first
+    def show_profiles(self):
+        if not self.is_enabled():
+            abort(404)
+        with self.lock:
+            profiles = list(reversed(self.history))
+        return jsonify({'profiles': profiles})
+
+
+def sum_statements(statements):
+    return (sum(stats['count'] for stats in statements.values()),
+            sum(stats['duration'] for stats in statements.values()))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['sql_profiler_started'] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or 'sql_profile' not in g:
+        return
+    stats = g.sql_profile.setdefault(statement, {'count': 0, 'duration': 0.0})
+    stats['count'] += 1
+    stats['duration'] += time.perf_counter() - conn.info['sql_profiler_started']